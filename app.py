@@ -1,10 +1,12 @@
 
 import streamlit as st
 import os
-import tempfile
-from pathlib import Path
-from config import PRESETS
+import json
+import uuid
+from config import PRESETS, RESOLUTION_OPTIONS
 import video_utils
+import audio_utils
+import render_jobs
 try:
     import download_bgm
 except ImportError:
@@ -123,18 +125,12 @@ st.markdown("""
 
 def get_bgm_files():
     """
-    assets/bgm/Genre/Track.mp3 をスキャンして辞書化
+    BGMカタログ (assets/bgm/Genre/Track.mp3) から曲名一覧を作る
+    カタログはフォルダが変わった時だけ作り直されるので、再実行のたびにディスクを走査しない
     Returns: {"Pop": ["track1.mp3", ...], "Rock": [...]}
     """
-    bgm_dict = {}
-    bgm_root = Path("assets/bgm")
-    if bgm_root.exists():
-        for genre_dir in bgm_root.iterdir():
-            if genre_dir.is_dir():
-                tracks = [f.name for f in genre_dir.glob("*.mp3")]
-                if tracks:
-                    bgm_dict[genre_dir.name] = tracks
-    return bgm_dict
+    catalog = audio_utils.get_bgm_catalog()
+    return {genre: [t["name"] for t in tracks] for genre, tracks in catalog.items()}
 
 bgm_data = get_bgm_files()
 
@@ -146,7 +142,6 @@ with st.sidebar:
     st.image("assets/logo.png", width=100) # Show App Logo if exists
     
     # --- Smart BGM Auto-Setup (Hidden if ready) ---
-    bgm_data = get_bgm_files()
     total_tracks = sum(len(tracks) for tracks in bgm_data.values())
     
     if total_tracks < 10:
@@ -158,16 +153,19 @@ with st.sidebar:
             else:
                 st.error("エラー: `download_bgm.py` が見つかりません。GitHubにファイルをアップロードしてください。")
 
+    # --- Font Check (presets without a font file in assets/fonts) ---
+    missing_fonts = video_utils.presets_without_font()
+    if missing_fonts:
+        with st.expander(f"⚠️ フォント未設定 ({len(missing_fonts)}件)"):
+            st.caption("assets/fonts に専用フォントがないため、代替フォントで描画されます")
+            st.write(", ".join(PRESETS[k]["display_name"] for k in missing_fonts))
+
     st.divider()
     st.markdown("### ⚙️ 設定・構成")
     
     # 1. 解像度選択 (Resolution)
     st.markdown("**1. 出力サイズ**")
-    res_options = {
-        "Reel / Story (9:16)": (1080, 1920),
-        "Post / Square (1:1)": (1080, 1080),
-        "YouTube / TV (16:9)": (1920, 1080)
-    }
+    res_options = RESOLUTION_OPTIONS
     selected_res_name = st.radio("サイズを選択", list(res_options.keys()), index=0, label_visibility="collapsed")
     target_res = res_options[selected_res_name]
     st.caption(f"解像度: {target_res[0]}x{target_res[1]}")
@@ -186,6 +184,22 @@ with st.sidebar:
         logo_path = "temp_logo.png"
         st.image(logo_path, caption="現在のロゴ", width=80)
 
+    st.divider()
+
+    # 3. 画質 (Encoder Profile)
+    st.markdown("**3. 画質**")
+    encoder_profile = st.radio(
+        "画質を選択", list(video_utils.ENCODER_PROFILES.keys()),
+        index=list(video_utils.ENCODER_PROFILES.keys()).index(video_utils.DEFAULT_ENCODER),
+        format_func=lambda k: video_utils.ENCODER_PROFILES[k]["display_name"],
+        label_visibility="collapsed",
+    )
+
+    # 省メモリモード (Streamlit Cloud など約1GBの環境向け。REEL_MAX_RSS_MB で既定値を設定)
+    default_max_rss = int(os.environ.get("REEL_MAX_RSS_MB", 0))
+    low_memory = st.checkbox("省メモリモード", value=default_max_rss > 0, help="1シーンずつ書き出し、メモリ上限を超えそうなら途中で止めます")
+    max_rss_mb = st.number_input("メモリ上限 (MB)", 256, 16384, default_max_rss or 900, step=64) if low_memory else None
+
 # ============================================================
 # 🎬 Main UI (2-Column Layout)
 # ============================================================
@@ -193,10 +207,6 @@ with st.sidebar:
 col_editor, col_preview = st.columns([1.5, 1])
 
 
-def get_base64_image(file_buffer):
-    import base64
-    return base64.b64encode(file_buffer.getvalue()).decode()
-
 # --- Left: Editor ---
 with col_editor:
     st.subheader("🛠️ 動画エディタ")
@@ -247,8 +257,11 @@ with col_editor:
             if bgm_data:
                 sel_genre = st.selectbox("BGMジャンル", list(bgm_data.keys()), index=list(bgm_data.keys()).index(default_genre) if default_genre in bgm_data else 0)
                 sel_track = st.selectbox("曲名", bgm_data[sel_genre])
-                bgm_path = str(Path("assets/bgm") / sel_genre / sel_track)
-                st.audio(bgm_path, format='audio/mp3') # BGM Preview
+                bgm_path = os.path.join(audio_utils.BGM_ROOT, sel_genre, sel_track)
+                track_info = audio_utils.get_track_info(bgm_path)
+                if track_info and track_info.get("duration"):
+                    st.caption(f"⏱️ {track_info['duration']:.0f}秒 / {track_info['bitrate_kbps']}kbps")
+                st.audio(audio_utils.read_track_bytes(bgm_path), format='audio/mp3') # BGM Preview
             else:
                 st.warning("BGMなし")
                 bgm_path = None
@@ -283,7 +296,8 @@ with col_editor:
                     
                     if img:
                         # Gradient Border Preview
-                        b64_img = get_base64_image(img)
+                        # 長辺360pxのサムネイル (アップロードごとにキャッシュ、元画像は送らない)
+                        thumb_uri = video_utils.get_thumbnail_data_uri(img.getbuffer())
                         # Simplified gradient Ring effect
                         html = f"""
                         <div style="
@@ -293,7 +307,7 @@ with col_editor:
                             display: inline-block;
                             width: 100%;
                         ">
-                            <img src="data:image/png;base64,{b64_img}" style="
+                            <img src="{thumb_uri}" style="
                                 width: 100%;
                                 border-radius: 9px;
                                 display: block;
@@ -336,47 +350,138 @@ with col_preview:
     
     st.write("") # Spacer
     
-    # Generate Button
-    if st.button("✨ 動画を生成する (Generate)", type="primary", use_container_width=True):
+    def save_scene_uploads(scenes):
+        """
+        アップロード画像を中身のハッシュ名で保存して (パス一覧, テキスト一覧) を返す
+        (同じ写真は再保存せず、デコード済みフレームのキャッシュもそのまま効く)
+        """
+        temp_img_paths = []
+        image_texts = []
+        
+        for sc in scenes:
+            temp_img_paths.append(video_utils.store_upload(sc["image"].getbuffer(), sc["image"].name))
+            image_texts.append(sc["text"])
+        return temp_img_paths, image_texts
+
+    # Quick Preview Button (低解像度・低fpsで数秒で確認)
+    if st.button("⚡ クイックプレビュー (低画質)", use_container_width=True):
         if not scenes:
             st.error("左側で画像を1枚以上アップロードしてください")
         else:
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # Temp save
-            temp_img_paths = []
-            image_texts = []
-            temp_dir = tempfile.mkdtemp()
-            
-            for sc in scenes:
-                p = os.path.join(temp_dir, sc["image"].name)
-                with open(p, "wb") as f:
-                    f.write(sc["image"].getbuffer())
-                temp_img_paths.append(p)
-                image_texts.append(sc["text"])
-                
-            status_text.text("生成中... ☕")
-            
+            temp_img_paths, image_texts = save_scene_uploads(scenes)
+            # 前回のプレビューを消す (セッションごとに別ファイルなので、他の人のプレビューは上書き・削除しない)
+            previous_preview = st.session_state.get("preview_path")
+            if previous_preview and os.path.exists(previous_preview):
+                os.remove(previous_preview)
+            preview_file = os.path.join("output", f"preview_reel_{uuid.uuid4().hex[:8]}.mp4")
+            st.session_state.preview_path = preview_file
             try:
-                output_file = "output/generated_reel.mp4"
                 if not os.path.exists("output"): os.makedirs("output")
-                
-                final_path = video_utils.generate_reel(
-                    images=temp_img_paths, texts=image_texts, preset=preset_data,
-                    output_path=output_file, logo_path=logo_path, target_resolution=target_res
-                )
-                
-                progress_bar.progress(100)
-                status_text.success("完成しました！")
-                st.video(final_path)
-                
-                with open(final_path, "rb") as f:
-                    st.download_button("📥 ダウンロード", f, "reel.mp4", "video/mp4", use_container_width=True)
-                    
+                with st.spinner("プレビュー作成中... ⚡"):
+                    preview_path = video_utils.generate_preview(
+                        images=temp_img_paths, texts=image_texts, preset=preset_data,
+                        output_path=preview_file, logo_path=logo_path, target_resolution=target_res,
+                        watermark_opacity=wm_opacity
+                    )
+                st.video(preview_path)
+                st.caption("※ プレビューは低解像度です。確定したら下の「動画を生成する」で本番書き出し")
             except Exception as e:
                 st.error(f"エラー: {e}")
                 import traceback
                 st.code(traceback.format_exc())
 
+    # Generate Button (バックグラウンドで書き出し、進捗は下の render_status で表示)
+    if st.button("✨ 動画を生成する (Generate)", type="primary", use_container_width=True):
+        if not scenes:
+            st.error("左側で画像を1枚以上アップロードしてください")
+        else:
+            # 前のジョブが残っていれば止めて、その出力ファイルを消す (output/ に溜めない)
+            if st.session_state.get("render_job_id"):
+                previous = render_jobs.cancel_job(st.session_state.render_job_id)
+                if previous is not None and previous.wait(timeout=5) and os.path.exists(previous.label):
+                    os.remove(previous.label)
+
+            # Temp save
+            temp_img_paths, image_texts = save_scene_uploads(scenes)
+            if not os.path.exists("output"): os.makedirs("output")
+            output_file = os.path.join("output", f"generated_reel_{uuid.uuid4().hex[:8]}.mp4")
+
+            st.session_state.render_job_id = render_jobs.start_render(
+                video_utils.generate_reel, label=output_file,
+                images=temp_img_paths, texts=image_texts, preset=dict(preset_data),
+                output_path=output_file, logo_path=logo_path, target_resolution=target_res,
+                encoder=encoder_profile, watermark_opacity=wm_opacity, instrument=True, cache=True, incremental=True, max_rss_mb=max_rss_mb
+            )
+
+    def show_render_report(report):
+        """
+        generate_reel(instrument=True) の計測結果 (工程ごとの時間・フレーム時間・メモリ)
+        """
+        with st.expander("📊 処理時間の内訳"):
+            total = report["wall"] or 1.0
+            st.caption(f"合計 {report['wall']:.2f}秒 / この書き出しの最大メモリ {report['peak_rss_mb'] or 0:.0f}MB")
+            cache_stats = video_utils.render_cache_stats()
+            st.caption(
+                f"書き出しキャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']} / "
+                f"{cache_stats['entries']}本 {cache_stats['bytes'] / 1024 / 1024:.0f}MB (上限 {cache_stats['max_bytes'] / 1024 / 1024:.0f}MB)"
+            )
+            segments = report["info"].get("segments")
+            if segments:
+                st.caption(f"シーン: {segments['total']}枚中 {segments['rendered']}枚を書き直し (残りは前回の書き出しを再利用)")
+            st.dataframe(
+                [{"工程": name, "時間(秒)": round(v["wall"], 3), "割合(%)": round(v["wall"] / total * 100, 1),
+                  "CPU(秒)": None if v["cpu"] is None else round(v["cpu"], 3), "回数": v["calls"]}
+                 for name, v in report["stages"].items()],
+                use_container_width=True, hide_index=True,
+            )
+            frame = report["get_frame"]
+            if frame["count"]:
+                st.caption(f"1フレームの合成: 平均 {frame['mean_ms']:.1f}ms / p95 {frame['p95_ms']:.1f}ms / 最大 {frame['max_ms']:.1f}ms")
+                st.bar_chart(frame["histogram"])
+            st.download_button(
+                "計測結果 (JSON)", json.dumps(report, ensure_ascii=False, indent=2), "render_stats.json", "application/json"
+            )
+
+    @st.fragment(run_every=1.0)
+    def render_progress(job):
+        """
+        書き出しジョブの進捗 (1秒ごとにこの部分だけ再描画するので、その間も編集できる)
+        終わったらページ全体を1回再実行し、結果は render_result で表示する (ポーリングもそこで止まる)
+        """
+        if job.status in render_jobs.FINISHED_STATES:
+            st.rerun()
+        label = "キャンセル中..." if job.cancelling else "生成中... ☕"
+        st.progress(job.fraction, text=f"{label} {job.done}/{job.total or '?'} フレーム")
+        st.caption(f"経過 {render_jobs.format_seconds(job.elapsed)} / 残り約 {render_jobs.format_seconds(job.eta())}")
+        if st.button("⏹ キャンセル", use_container_width=True, disabled=job.cancelling):
+            job.cancel()
+
+    def render_result(job):
+        """
+        終わったジョブの結果 (動画・ダウンロード・計測結果 / キャンセル / エラー)
+        """
+        if job.status == render_jobs.DONE:
+            final_path, report = job.result
+            if report["info"].get("render_cache") == "hit":
+                st.success("同じ内容の動画が見つかったので、書き出し済みのものを表示しています ⚡")
+            else:
+                st.success(f"完成しました！ ({render_jobs.format_seconds(job.elapsed)})")
+            st.video(final_path)
+            with open(final_path, "rb") as f:
+                st.download_button("📥 ダウンロード", f, "reel.mp4", "video/mp4", use_container_width=True)
+            show_render_report(report)
+        elif job.status == render_jobs.CANCELLED:
+            st.info("生成をキャンセルしました")
+        else:
+            st.error(f"エラー: {job.error}")
+            st.code(job.traceback)
+
+    job_id = st.session_state.get("render_job_id")
+    render_job = render_jobs.get_job(job_id) if job_id else None
+    if render_job is not None:
+        if render_job.status in render_jobs.FINISHED_STATES:
+            render_result(render_job)
+        else:
+            render_progress(render_job)
+
 st.write("---")
@@ -0,0 +1,298 @@
+import os
+import json
+import wave
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+from cache_utils import CACHE_ROOT, DiskCache, LRUCache, content_hash, file_signature
+
+AUDIO_FPS = 44100      # 書き出し時のサンプリングレート
+AUDIO_CHANNELS = 2
+PCM_CACHE_VERSION = 1  # 保存形式を変えたら上げる
+
+# デコード済みPCM (int16 .npy) と音量メタデータ (.json)
+_pcm_cache = DiskCache("pcm", max_bytes=1024 * 1024 * 1024)
+
+# ============================================================
+# 🎧 Decode
+# ============================================================
+
+def decode_audio(path, fps=AUDIO_FPS, channels=AUDIO_CHANNELS):
+    """
+    ffmpeg で音声ファイルを int16 の (サンプル数, チャンネル数) 配列にデコードする
+    """
+    cmd = [
+        get_setting("FFMPEG_BINARY"), "-v", "error", "-i", path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(channels), "-ar", str(fps), "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed for {path}: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+
+
+def analyze_pcm(pcm, fps=AUDIO_FPS):
+    """
+    ピーク・RMS (dBFS) などの音量メタデータ
+    """
+    samples = pcm.astype(np.float32) / 32768.0
+    peak = float(np.abs(samples).max()) if samples.size else 0.0
+    rms = float(np.sqrt(np.mean(np.square(samples)))) if samples.size else 0.0
+    return {
+        "fps": fps,
+        "channels": int(pcm.shape[1]) if pcm.ndim == 2 else 1,
+        "samples": int(pcm.shape[0]),
+        "duration": pcm.shape[0] / fps,
+        "peak": peak,
+        "peak_dbfs": float(20 * np.log10(peak)) if peak > 0 else -np.inf,
+        "rms_dbfs": float(20 * np.log10(rms)) if rms > 0 else -np.inf,
+    }
+
+# ============================================================
+# 💾 PCM Cache
+# ============================================================
+
+def pcm_cache_key(path, fps=AUDIO_FPS):
+    return content_hash(PCM_CACHE_VERSION, file_signature(path), fps, AUDIO_CHANNELS)
+
+
+def load_pcm(path, fps=AUDIO_FPS):
+    """
+    BGMのデコード済みPCM (メモリマップされた int16 配列) とメタデータを返す
+    (ファイルパス + mtime ごとに1回だけ ffmpeg でデコードする)
+    """
+    key = pcm_cache_key(path, fps)
+    pcm = _pcm_cache.load_array(key, mmap_mode="r")
+    meta_path = _pcm_cache.get_path(key, ".json")
+
+    if pcm is None or meta_path is None:
+        decoded = decode_audio(path, fps=fps)
+        meta = analyze_pcm(decoded, fps=fps)
+        meta["source"] = os.path.abspath(path)
+        _pcm_cache.save_array(key, decoded)
+        _pcm_cache.write(key, ".json", lambda tmp: _write_json(tmp, meta))
+        pcm = _pcm_cache.load_array(key, mmap_mode="r")
+        if pcm is None:
+            pcm = decoded  # キャッシュに書けなかった (容量超過など)
+        return pcm, meta
+
+    with open(meta_path, encoding="utf-8") as f:
+        return pcm, json.load(f)
+
+
+def load_pcm_meta(path, fps=AUDIO_FPS):
+    """
+    音量メタデータだけ (未デコードならデコードしてキャッシュする)
+    """
+    return load_pcm(path, fps=fps)[1]
+
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def match_gain(meta, target_dbfs=-16.0):
+    """
+    RMS を target_dbfs に揃えるための倍率 (ピークが 0dBFS を超えない範囲で)
+    """
+    if not np.isfinite(meta["rms_dbfs"]) or meta["peak"] <= 0:
+        return 1.0
+    gain = 10 ** ((target_dbfs - meta["rms_dbfs"]) / 20)
+    return float(min(gain, 1.0 / meta["peak"]))
+
+# ============================================================
+# 🎚️ Assembly
+# ============================================================
+
+def assemble_bgm(pcm, duration, fps=AUDIO_FPS, fade_duration=3.0, crossfade=0.0, gain=1.0):
+    """
+    ループ → カット → フェードアウトを1回で行い、float32 の (サンプル数, チャンネル数) 配列を返す
+    crossfade > 0 ならループのつなぎ目を crossfade 秒だけクロスフェードする
+    """
+    n = int(round(duration * fps))
+    track = np.asarray(pcm)
+    if n <= 0 or len(track) == 0:
+        return np.zeros((max(n, 0), AUDIO_CHANNELS), dtype=np.float32)
+
+    if len(track) >= n:
+        out = track[:n].astype(np.float32)
+    else:
+        xf = int(crossfade * fps)
+        if xf > 0 and len(track) > 2 * xf:
+            # 1周分 = 先頭xfサンプルを「前の周の末尾」とクロスフェードしたもの
+            ramp = np.linspace(0.0, 1.0, xf, dtype=np.float32)[:, None]
+            unit = track[:len(track) - xf].astype(np.float32)
+            unit[:xf] = unit[:xf] * ramp + track[-xf:] * (1.0 - ramp)
+        else:
+            xf = 0
+            unit = track.astype(np.float32)
+        reps = -(-n // len(unit))
+        out = np.tile(unit, (reps, 1))[:n]
+        if xf:
+            out[:xf] = track[:xf]  # 最初の周はつなぎ目なし
+
+    out *= gain / 32768.0
+
+    # 最後の fade_duration 秒を線形にフェードアウト
+    fade = min(n, int(fade_duration * fps))
+    if fade > 0:
+        out[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, None]
+
+    np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+def write_wav(path, samples, fps=AUDIO_FPS):
+    """
+    float32 の (サンプル数, チャンネル数) 配列を 16bit WAV に1回で書き出す
+    """
+    pcm16 = np.ascontiguousarray(np.round(samples * 32767.0), dtype=np.int16)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(pcm16.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(fps)
+        w.writeframes(memoryview(pcm16))
+    return path
+
+# ============================================================
+# 📚 BGM Catalog
+# ============================================================
+
+BGM_ROOT = os.path.join("assets", "bgm")
+BGM_EXTENSIONS = (".mp3",)
+CATALOG_FILE = "bgm_catalog.json"  # CACHE_ROOT 以下に保存する曲ごとのメタデータ
+
+_catalog = None
+_track_bytes = LRUCache(max_items=8, max_bytes=64 * 1024 * 1024)
+
+
+def _dir_stamp(root):
+    """
+    ルートとジャンルフォルダの mtime 一覧 (曲の追加・削除で変わる)
+    """
+    if not os.path.isdir(root):
+        return None
+    stamp = [(root, os.stat(root).st_mtime_ns)]
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_dir():
+            stamp.append((entry.name, entry.stat().st_mtime_ns))
+    return stamp
+
+
+def _track_entry(path):
+    """
+    まだ調べていない曲の情報 (名前・パス・シグネチャだけ)
+    """
+    return {"name": os.path.basename(path), "path": path, "signature": list(file_signature(path))}
+
+
+def probe_track(path):
+    """
+    曲の長さ・ビットレート・音量を1回だけ調べる
+    デコードは load_pcm 経由なので、PCM はキャッシュに残り書き出し時に再利用される
+    """
+    info = _track_entry(path)
+    try:
+        meta = load_pcm_meta(path)
+        info.update(
+            duration=meta["duration"],
+            bitrate_kbps=round(os.path.getsize(path) * 8 / meta["duration"] / 1000) if meta["duration"] else None,
+            peak_dbfs=meta["peak_dbfs"],
+            rms_dbfs=meta["rms_dbfs"],
+        )
+    except Exception as e:
+        print(f"BGM probe failed for {path}: {e}")
+        info.update(duration=None, bitrate_kbps=None, peak_dbfs=None, rms_dbfs=None)
+    return info
+
+
+def _catalog_path():
+    return os.path.join(CACHE_ROOT, CATALOG_FILE)
+
+
+def _load_stored_catalog():
+    try:
+        with open(_catalog_path(), encoding="utf-8") as f:
+            return {t["path"]: t for t in json.load(f)}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def build_bgm_catalog(root=BGM_ROOT):
+    """
+    assets/bgm/<ジャンル>/<曲> を走査して {ジャンル: [曲情報, ...]} を作る
+    調査済みの曲 (パス + mtime + サイズが同じ) は保存済みのメタデータを使う
+    新しい曲はここではデコードせず、get_track_info で初めて選ばれた時に調べる (起動を待たせない)
+    """
+    stored = _load_stored_catalog()
+    genres = {}
+    if os.path.isdir(root):
+        for genre_dir in sorted(os.scandir(root), key=lambda e: e.name):
+            if not genre_dir.is_dir():
+                continue
+            tracks = []
+            for name in sorted(os.listdir(genre_dir.path)):
+                if not name.lower().endswith(BGM_EXTENSIONS):
+                    continue
+                path = os.path.join(genre_dir.path, name)
+                info = stored.get(path)
+                if info is None or info.get("signature") != list(file_signature(path)):
+                    info = _track_entry(path)
+                tracks.append(info)
+            if tracks:
+                genres[genre_dir.name] = tracks
+
+    _save_catalog(genres)
+    return genres
+
+
+def _save_catalog(genres):
+    try:
+        os.makedirs(CACHE_ROOT, exist_ok=True)
+        tmp = _catalog_path() + ".tmp"
+        _write_json(tmp, [t for tracks in genres.values() for t in tracks])
+        os.replace(tmp, _catalog_path())
+    except OSError as e:
+        print(f"BGM catalog write failed: {e}")
+
+
+def get_bgm_catalog(root=BGM_ROOT):
+    """
+    BGMカタログ (フォルダの mtime が変わった時だけ作り直す)
+    """
+    global _catalog
+    stamp = _dir_stamp(root)
+    if _catalog is None or _catalog["root"] != root or _catalog["stamp"] != stamp:
+        _catalog = {"root": root, "stamp": stamp, "genres": build_bgm_catalog(root)}
+    return _catalog["genres"]
+
+
+def get_track_info(path, root=BGM_ROOT):
+    """
+    曲の情報 (まだ調べていなければここで調べてカタログに保存する)
+    """
+    genres = get_bgm_catalog(root)
+    for tracks in genres.values():
+        for info in tracks:
+            if info["path"] == path:
+                if "duration" not in info:
+                    info.update(probe_track(path))
+                    _save_catalog(genres)
+                return info
+    return None
+
+
+def read_track_bytes(path):
+    """
+    試聴用に曲のバイト列を返す (直近の数曲はメモリに保持)
+    """
+    key = file_signature(path)
+    data = _track_bytes.get(key)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        _track_bytes.put(key, data, nbytes=len(data))
+    return data
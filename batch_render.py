@@ -0,0 +1,204 @@
+"""
+JSONLのジョブ一覧からリール動画をまとめて書き出す (Streamlitなし)
+
+1行 = 1ジョブ:
+{"id": "shop01", "images": ["a.jpg", "b.jpg"], "texts": ["本日限定", ""],
+ "preset": "Food_Luxury", "overrides": {"text_color": "#FFCC00", "duration": 2.5},
+ "bgm": "assets/bgm/Chill/asleep.mp3", "resolution": "Reel / Story (9:16)",
+ "output": "out/shop01.mp4", "logo": "assets/logo.png", "watermark_opacity": 0.3, "encoder": "standard",
+ "max_rss_mb": 900}
+
+相対パスは実行時のフォルダではなく、マニフェストのあるフォルダから解決する
+(上の例はリポジトリ直下に置いたマニフェストの場合。別のフォルダに置くなら "../assets/..." か絶対パスで書く)
+images / bgm / logo が見つからないジョブがあれば、書き出し前に行番号付きで止める
+使い方: python batch_render.py jobs.jsonl --workers 4 --results results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import PRESETS, RESOLUTION_OPTIONS
+from cache_utils import content_hash, file_signature
+
+JOB_STAMP_SUFFIX = ".job.json"  # 出力の横に置く「どの設定で書き出したか」の記録
+
+# ============================================================
+# 📋 Manifest
+# ============================================================
+
+def load_jobs(manifest_path):
+    """
+    JSONLを読み、相対パスを解決したジョブ一覧を返す
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(p):
+        return p if p is None or os.path.isabs(p) else os.path.join(base_dir, p)
+
+    jobs = []
+    with open(manifest_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"line{line_no}")
+            if job.get("preset") not in PRESETS:
+                raise ValueError(f"{manifest_path}:{line_no}: unknown preset {job.get('preset')!r}")
+            if not job.get("images") or not job.get("output"):
+                raise ValueError(f"{manifest_path}:{line_no}: 'images' and 'output' are required")
+            job["images"] = [resolve(p) for p in job["images"]]
+            job["output"] = resolve(job["output"])
+            job["bgm"] = resolve(job.get("bgm"))
+            inputs = job["images"] + [job["bgm"]]
+            if "logo" in job:
+                job["logo"] = resolve(job["logo"])
+                inputs.append(job["logo"])
+            else:
+                job["logo"] = "assets/logo.png"  # 指定がなければアプリと同じ既定のロゴ (なければ透かしなし)
+            # BGM やロゴがないと音なし・透かしなしで「成功」してしまうので、ここで止める
+            missing = [p for p in inputs if p is not None and not os.path.exists(p)]
+            if missing:
+                raise ValueError(f"{manifest_path}:{line_no}: file not found: {', '.join(missing)}")
+            jobs.append(job)
+    return jobs
+
+
+def job_resolution(job):
+    res = job.get("resolution", "Reel / Story (9:16)")
+    if isinstance(res, str):
+        if res not in RESOLUTION_OPTIONS:
+            raise ValueError(f"Unknown resolution {res!r} (choose from {list(RESOLUTION_OPTIONS)})")
+        return RESOLUTION_OPTIONS[res]
+    return tuple(res)
+
+
+def job_preset(job):
+    """
+    プリセットに上書き設定と BGM を反映した dict
+    """
+    preset = dict(PRESETS[job["preset"]])
+    preset.update(job.get("overrides") or {})
+    if job.get("bgm"):
+        preset["bgm_path"] = job["bgm"]
+    return preset
+
+
+def job_stamp(job):
+    """
+    ジョブ内容と入力ファイル (mtime/サイズ) のハッシュ。これが同じなら書き出し済みとみなす
+    """
+    inputs = [file_signature(p) for p in job["images"] + [job.get("bgm"), job.get("logo")]]
+    return content_hash(
+        job["images"], job.get("texts", []), job_preset(job), job_resolution(job),
+        job.get("encoder"), job.get("watermark_opacity"), inputs,
+    )
+
+
+def is_up_to_date(job):
+    stamp_path = job["output"] + JOB_STAMP_SUFFIX
+    if not os.path.exists(job["output"]) or not os.path.exists(stamp_path):
+        return False
+    try:
+        with open(stamp_path, encoding="utf-8") as f:
+            return json.load(f).get("stamp") == job_stamp(job)
+    except (OSError, ValueError):
+        return False
+
+# ============================================================
+# 🏭 Worker
+# ============================================================
+
+def run_job(job):
+    """
+    1ジョブを書き出して結果レコードを返す (ProcessPoolExecutor から呼ばれる)
+    """
+    import video_utils
+
+    record = {"id": job["id"], "output": job["output"]}
+    started = time.time()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(job["output"])), exist_ok=True)
+        video_utils.generate_reel(
+            images=job["images"], texts=job.get("texts", []), preset=job_preset(job),
+            output_path=job["output"], logo_path=job["logo"], target_resolution=job_resolution(job),
+            encoder=job.get("encoder"),
+            watermark_opacity=job.get("watermark_opacity", video_utils.WATERMARK_OPACITY),
+            max_rss_mb=job.get("max_rss_mb"),
+        )
+        with open(job["output"] + JOB_STAMP_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({"stamp": job_stamp(job), "id": job["id"]}, f)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - started, 3)
+    return record
+
+
+def run_batch(jobs, workers=1, force=False, results_path=None, encoder=None, max_rss_mb=None):
+    """
+    ジョブを workers 並列で書き出す。書き出し済み (job_stamp が同じ) のジョブは飛ばす
+    Returns: 結果レコードのリスト
+    """
+    records = []
+    results_file = open(results_path, "a", encoding="utf-8") if results_path else None
+
+    def emit(record):
+        records.append(record)
+        print(f"[{record['status']:>7}] {record['id']} ({record.get('seconds', 0):.1f}s) {record.get('error', '')}")
+        if results_file:
+            results_file.write(json.dumps({k: v for k, v in record.items() if k != "traceback"}, ensure_ascii=False) + "\n")
+            results_file.flush()
+
+    try:
+        todo = []
+        for job in jobs:
+            if encoder and not job.get("encoder"):
+                job["encoder"] = encoder
+            if max_rss_mb and not job.get("max_rss_mb"):
+                job["max_rss_mb"] = max_rss_mb
+            if not force and is_up_to_date(job):
+                emit({"id": job["id"], "output": job["output"], "status": "skipped", "seconds": 0.0})
+            else:
+                todo.append(job)
+
+        if workers <= 1:
+            for job in todo:
+                emit(run_job(job))
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                for future in as_completed([pool.submit(run_job, job) for job in todo]):
+                    emit(future.result())
+    finally:
+        if results_file:
+            results_file.close()
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSONLのジョブ一覧からリール動画をまとめて書き出す")
+    parser.add_argument("manifest", help="ジョブ一覧 (.jsonl)")
+    parser.add_argument("--workers", type=int, default=1, help="同時に書き出すジョブ数")
+    parser.add_argument("--results", help="ジョブごとの結果・所要時間を追記する .jsonl")
+    parser.add_argument("--encoder", help="encoder 未指定のジョブに使うプロファイル (draft / standard / archive)")
+    parser.add_argument("--force", action="store_true", help="書き出し済みのジョブもやり直す")
+    parser.add_argument("--max-rss-mb", type=float, help="1ジョブあたりのメモリ上限 (省メモリモード、並列時はジョブごと)")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.manifest)
+    records = run_batch(jobs, workers=args.workers, force=args.force, results_path=args.results, encoder=args.encoder, max_rss_mb=args.max_rss_mb)
+    failed = [r for r in records if r["status"] == "failed"]
+    print(f"Done: {len(records) - len(failed)} ok/skipped, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
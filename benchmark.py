@@ -0,0 +1,288 @@
+"""
+書き出し速度のベンチマーク (オフラインで実行できる)
+
+合成した画像 (サイズ・縦横比・EXIF回転がいろいろ) と合成キャプション (短文 / 長文 / 絵文字多め) で
+config.PRESETS の全プリセット × config.RESOLUTION_OPTIONS の全解像度を書き出し、
+fps・合計時間・最大メモリを JSON レポートにまとめる。BGM は合成したトーン、フォントはシステムフォント、
+絵文字はネットワークから取らずに描く。キャッシュは毎回空の状態から測る
+
+使い方:
+  python benchmark.py --out bench.json
+  python benchmark.py --presets Food_Luxury Fashion --resolutions "Post / Square (1:1)" --scenes 3
+  python benchmark.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from config import PRESETS, RESOLUTION_OPTIONS
+
+REPORT_SCHEMA = 1
+SEED = 20240601
+
+# (名前, 保存サイズ, EXIF Orientation, 形式)
+IMAGE_SPECS = [
+    ("landscape_12mp", (4032, 3024), 1, "jpg"),
+    ("portrait_exif6", (4032, 3024), 6, "jpg"),   # 横長で保存、表示は縦長
+    ("square", (1080, 1080), 1, "jpg"),
+    ("upside_down_exif3", (1920, 1080), 3, "jpg"),
+    ("tall_exif8", (1200, 800), 8, "jpg"),
+    ("small_png", (640, 480), 1, "png"),
+]
+
+CAPTIONS = [
+    "本日限定",
+    "季節のフルーツをふんだんに使った当店自慢のタルトです。ご予約はプロフィールのリンクから！ Limited time only.",
+    "🍰✨新作スイーツ登場🎉🍓🍫💕 今だけ🔥",
+    "",
+]
+
+BGM_SECONDS = 20.0
+
+# ============================================================
+# 🧪 Synthetic Inputs
+# ============================================================
+
+def make_image(path, size, orientation, seed):
+    """
+    グラデーション + ブロック + ノイズの画像 (JPEGのデコード負荷が実写に近くなるように)
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([x / w * 255, y / h * 255, (1 - x / w) * 200 + 30], axis=-1)
+    for _ in range(12):
+        bw, bh = rng.integers(w // 10, w // 3), rng.integers(h // 10, h // 3)
+        bx, by = rng.integers(0, w - bw), rng.integers(0, h - bh)
+        base[by:by + bh, bx:bx + bw] = rng.integers(0, 256, 3)
+    base += rng.normal(0, 12, base.shape).astype(np.float32)
+    img = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+
+    if path.endswith(".png"):
+        img.save(path)
+    else:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        img.save(path, quality=90, exif=exif.tobytes())
+    return path
+
+
+def make_tone(path, seconds=BGM_SECONDS):
+    """
+    和音 + 弱いノイズのステレオ音声 (BGMの代わり)
+    """
+    import audio_utils
+
+    t = np.arange(int(seconds * audio_utils.AUDIO_FPS)) / audio_utils.AUDIO_FPS
+    mono = sum(0.15 * np.sin(2 * np.pi * f * t) for f in (220.0, 277.2, 329.6))
+    mono += np.random.default_rng(SEED).normal(0, 0.01, t.size)
+    stereo = np.stack([mono, np.roll(mono, 441)], axis=1).astype(np.float32)
+    return audio_utils.write_wav(path, stereo)
+
+
+def make_inputs(work_dir):
+    images = []
+    for i, (name, size, orientation, fmt) in enumerate(IMAGE_SPECS):
+        images.append(make_image(os.path.join(work_dir, f"{name}.{fmt}"), size, orientation, SEED + i))
+    return images, make_tone(os.path.join(work_dir, "tone.wav"))
+
+# ============================================================
+# ⏱️ Runs
+# ============================================================
+
+def run_case(case):
+    """
+    1プリセット × 1解像度を書き出して計測する (毎回新しいプロセスで呼ばれる)
+    キャッシュ・フォント・絵文字の設定は video_utils を読み込む前に決める
+    """
+    os.environ["REEL_CACHE_DIR"] = case["cache_dir"]
+    os.environ["REEL_OFFLINE"] = "1"
+    import video_utils
+
+    video_utils.FONTS_DIR = os.path.join(case["cache_dir"], "no-fonts")  # assets/fonts は使わない
+
+    preset = dict(PRESETS[case["preset"]], bgm_path=case["bgm"])
+    if case.get("duration"):
+        preset["duration"] = case["duration"]
+    output_path = os.path.join(case["cache_dir"], "out.mp4")
+
+    started = time.perf_counter()
+    _, report = video_utils.generate_reel(
+        case["images"], case["texts"], preset, output_path=output_path, logo_path=case["logo"],
+        target_resolution=tuple(case["resolution"]), encoder=case["encoder"], workers=case["workers"], instrument=True,
+    )
+    seconds = time.perf_counter() - started
+
+    frames = report["get_frame"]["count"]
+    return {
+        "preset": case["preset"],
+        "resolution_name": case["resolution_name"],
+        "resolution": list(case["resolution"]),
+        "animation": preset["animation"],
+        "scenes": len(case["images"]),
+        "frames": frames,
+        "seconds": seconds,
+        "fps": frames / seconds if seconds else None,
+        # 各ケースは新しいプロセスで動くので、起動からの最大 = このケースの最大
+        "peak_rss_mb": report.get("peak_worker_rss_mb") or report["process_peak_rss_mb"],
+        "output_bytes": os.path.getsize(output_path),
+        "font": video_utils.resolve_font(preset.get("font_file", "Arial")),
+        "get_frame": report["get_frame"],
+        "stages": {name: round(st["wall"], 4) for name, st in report["stages"].items()},
+    }
+
+
+def run_isolated(fn, *args):
+    """
+    新しいプロセスで fn(*args) を実行する
+    (最大メモリは fork 元から引き継がれるので、ケースごと・入力の生成も親とは別プロセスにする)
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(fn, *args).result()
+
+# ============================================================
+# 📄 Report
+# ============================================================
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment_info():
+    import PIL
+    import moviepy
+
+    return {
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "moviepy": moviepy.__version__,
+    }
+
+
+def summarize(runs):
+    """
+    解像度ごとの合計時間・平均fps・最大メモリ
+    """
+    summary = {}
+    for run in runs:
+        if "error" in run:
+            continue
+        s = summary.setdefault(run["resolution_name"], {"runs": 0, "seconds": 0.0, "frames": 0, "peak_rss_mb": 0.0})
+        s["runs"] += 1
+        s["seconds"] += run["seconds"]
+        s["frames"] += run["frames"]
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], run["peak_rss_mb"] or 0.0)
+    for s in summary.values():
+        s["fps"] = s["frames"] / s["seconds"] if s["seconds"] else None
+    return summary
+
+
+def run_benchmark(presets=None, resolutions=None, scenes=len(IMAGE_SPECS), duration=None, encoder="standard", workers=1, logo_path="assets/logo.png"):
+    """
+    プリセット × 解像度をすべて書き出してレポート dict を返す
+    """
+    presets = presets or list(PRESETS)
+    resolutions = resolutions or list(RESOLUTION_OPTIONS)
+    work_dir = tempfile.mkdtemp(prefix="reel_bench_")
+    try:
+        images, bgm = run_isolated(make_inputs, work_dir)
+        images = [images[i % len(images)] for i in range(scenes)]
+        texts = [CAPTIONS[i % len(CAPTIONS)] for i in range(scenes)]
+
+        runs = []
+        for res_name in resolutions:
+            for preset in presets:
+                cache_dir = tempfile.mkdtemp(prefix="cache_", dir=work_dir)
+                case = {
+                    "preset": preset, "resolution_name": res_name, "resolution": RESOLUTION_OPTIONS[res_name],
+                    "images": images, "texts": texts, "bgm": bgm, "logo": os.path.abspath(logo_path),
+                    "duration": duration, "encoder": encoder, "workers": workers, "cache_dir": cache_dir,
+                }
+                try:
+                    run = run_isolated(run_case, case)
+                    print(f"{res_name:<22} {preset:<16} {run['frames']:>5} frames {run['seconds']:7.2f}s {run['fps']:6.1f} fps {run['peak_rss_mb'] or 0:7.0f} MB")
+                except Exception as e:
+                    run = {"preset": preset, "resolution_name": res_name, "error": f"{type(e).__name__}: {e}"}
+                    print(f"{res_name:<22} {preset:<16} FAILED {run['error']}")
+                runs.append(run)
+                shutil.rmtree(cache_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "schema": REPORT_SCHEMA,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment_info(),
+        "settings": {
+            "scenes": scenes, "duration": duration, "encoder": encoder, "workers": workers, "seed": SEED,
+            "images": [{"name": n, "size": list(s), "orientation": o, "format": f} for n, s, o, f in IMAGE_SPECS],
+            "captions": CAPTIONS, "cache": "cold",
+        },
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+
+
+def compare_reports(old, new):
+    """
+    2つのレポートの同じケースを並べ、fps の変化率を表示する
+    """
+    old_runs = {(r["resolution_name"], r["preset"]): r for r in old["runs"] if "error" not in r}
+    print(f"{'resolution':<22} {'preset':<16} {'old fps':>8} {'new fps':>8} {'change':>8}")
+    for run in new["runs"]:
+        prev = old_runs.get((run["resolution_name"], run["preset"]))
+        if "error" in run or prev is None:
+            continue
+        change = (run["fps"] / prev["fps"] - 1) * 100 if prev["fps"] else float("nan")
+        print(f"{run['resolution_name']:<22} {run['preset']:<16} {prev['fps']:8.1f} {run['fps']:8.1f} {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="プリセット × 解像度の書き出しベンチマーク")
+    parser.add_argument("--out", default="benchmark_report.json", help="レポートの保存先 (.json)")
+    parser.add_argument("--presets", nargs="+", choices=list(PRESETS), help="対象プリセット (省略時はすべて)")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTION_OPTIONS), help="対象解像度 (省略時はすべて)")
+    parser.add_argument("--scenes", type=int, default=len(IMAGE_SPECS), help="1本あたりの画像枚数")
+    parser.add_argument("--duration", type=float, help="1枚あたりの秒数 (省略時はプリセットの値)")
+    parser.add_argument("--encoder", default="standard", help="エンコード設定 (draft / standard / archive)")
+    parser.add_argument("--workers", type=int, default=1, help="generate_reel の並列数")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="2つのレポートを比較して終了")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f_old, open(args.compare[1], encoding="utf-8") as f_new:
+            compare_reports(json.load(f_old), json.load(f_new))
+        return 0
+
+    report = run_benchmark(args.presets, args.resolutions, scenes=args.scenes, duration=args.duration, encoder=args.encoder, workers=args.workers)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Report: {args.out}")
+    for res_name, s in report["summary"].items():
+        print(f"  {res_name:<22} {s['runs']} runs {s['seconds']:7.1f}s {s['fps'] or 0:6.1f} fps peak {s['peak_rss_mb']:.0f} MB")
+    return 1 if any("error" in r for r in report["runs"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# キャッシュの保存先 (環境変数で変更可)
+CACHE_ROOT = os.environ.get("REEL_CACHE_DIR", "cache")
+TMP_PREFIX = ".tmp-"  # 書き込み途中のファイル (削除・集計の対象外)
+
+# ============================================================
+# 🔑 Keys
+# ============================================================
+
+def content_hash(*parts):
+    """
+    任意の値 (str, 数値, tuple, None ...) の並びから SHA-256 キーを作る
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_signature(path):
+    """
+    ファイルの (絶対パス, mtime, サイズ)。存在しなければ None
+    """
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def data_hash(data):
+    """
+    バイト列の SHA-256 (同じ内容なら file_hash と同じ値になる)
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    ファイル内容の SHA-256
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ============================================================
+# 🧠 Memory Tier
+# ============================================================
+
+class LRUCache:
+    """
+    件数と合計バイト数で上限を持つメモリ上のLRU
+    """
+
+    def __init__(self, max_items=64, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = getattr(value, "nbytes", 0)
+        with self._lock:
+            if key in self._items:
+                self.total_bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.total_bytes += nbytes
+            while self._items and (
+                len(self._items) > self.max_items
+                or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            ):
+                _, (_, old_bytes) = self._items.popitem(last=False)
+                self.total_bytes -= old_bytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_bytes = 0
+
+# ============================================================
+# 💾 Disk Tier
+# ============================================================
+
+class DiskCache:
+    """
+    CACHE_ROOT/<name>/ 以下のファイルキャッシュ
+    ヒット時に mtime を更新し、合計サイズが max_bytes を超えたら古い順に削除する
+    """
+
+    def __init__(self, name, max_bytes=512 * 1024 * 1024, root=None):
+        self.dir = os.path.join(root or CACHE_ROOT, name)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, key, ext=""):
+        return os.path.join(self.dir, f"{key}{ext}")
+
+    def get_path(self, key, ext=""):
+        """
+        キャッシュ済みファイルのパス (なければ None)
+        """
+        p = self.path(key, ext)
+        if os.path.exists(p):
+            try:
+                os.utime(p)
+            except OSError:
+                pass
+            self.hits += 1
+            return p
+        self.misses += 1
+        return None
+
+    def put_file(self, key, ext, src_path, move=False):
+        """
+        既存ファイルをキャッシュに登録する (一時ファイル経由で置き換えるので途中状態は見えない)
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        dst = self.path(key, ext)
+        if move:
+            os.replace(src_path, dst)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=TMP_PREFIX, suffix=ext)
+            with os.fdopen(fd, "wb") as out, open(src_path, "rb") as src:
+                for chunk in iter(lambda: src.read(1 << 20), b""):
+                    out.write(chunk)
+            os.replace(tmp, dst)
+        self.evict()
+        return dst
+
+    def write(self, key, ext, writer):
+        """
+        writer(tmp_path) でファイルを書き出して登録する
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=TMP_PREFIX, suffix=ext)
+        os.close(fd)
+        try:
+            writer(tmp)
+            os.replace(tmp, self.path(key, ext))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return self.path(key, ext)
+
+    def load_array(self, key, mmap_mode=None):
+        p = self.get_path(key, ".npy")
+        if p is None:
+            return None
+        try:
+            return np.load(p, mmap_mode=mmap_mode)
+        except (OSError, ValueError):
+            # 壊れたファイルは捨ててミス扱い
+            os.remove(p)
+            return None
+
+    def save_array(self, key, array):
+        return self.write(key, ".npy", lambda tmp: np.save(tmp, array))
+
+    def size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        if not os.path.isdir(self.dir):
+            return []
+        entries = []
+        for entry in os.scandir(self.dir):
+            if entry.is_file() and not entry.name.startswith(TMP_PREFIX):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # 他プロセスが削除済み
+                entries.append((st.st_mtime, entry.path, st.st_size))
+        return entries
+
+    def evict(self):
+        """
+        合計サイズが max_bytes 以下になるまで古いファイルから削除
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        for _, path, _ in self._entries():
+            os.remove(path)
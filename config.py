@@ -152,5 +152,12 @@ PRESETS = {
 # デフォルト設定
 DEFAULT_DURATION = 3.0
 VIDEO_SIZE = (1080, 1920) # 9:16 Full HD
+
+# 出力サイズの選択肢 (サイドバー・バッチ処理共通)
+RESOLUTION_OPTIONS = {
+    "Reel / Story (9:16)": (1080, 1920),
+    "Post / Square (1:1)": (1080, 1080),
+    "YouTube / TV (16:9)": (1920, 1080)
+}
 WATERMARK_PATH = "assets/logo.png"
 WATERMARK_OPACITY = 0.3
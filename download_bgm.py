@@ -1,8 +1,16 @@
 
 import os
-import requests
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_utils import file_hash
 
 # ============================================================
 # 🎵 BGM Curation (GitHub Optimized - Direct Raw URLs)
@@ -40,36 +48,176 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
-def download_bgm(force=False):
-    base_path = Path("assets/bgm")
-    
+MANIFEST_NAME = "manifest.json"  # assets/bgm/manifest.json: {"Genre/file.mp3": {"url", "size", "sha256"}}
+CHUNK_SIZE = 64 * 1024
+DEFAULT_WORKERS = 4
+
+# ============================================================
+# 🌐 Session & Manifest
+# ============================================================
+
+def make_session(pool_size=DEFAULT_WORKERS):
+    """
+    接続を使い回すセッション (一時的なエラーは自動リトライ)
+    """
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def load_manifest(base_path):
+    try:
+        with open(Path(base_path) / MANIFEST_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(base_path, manifest):
+    path = Path(base_path) / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+# ============================================================
+# ⬇ Download
+# ============================================================
+
+def download_file(session, url, save_path, progress=None, timeout=30):
+    """
+    url を save_path.part に書き出し (途中から再開)、完了したら save_path にリネームする
+    Returns: {"url", "size", "sha256"}
+    """
+    save_path = Path(save_path)
+    part_path = save_path.with_name(save_path.name + ".part")
+    offset = part_path.stat().st_size if part_path.exists() else 0
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 416:
+        # .part が壊れている (サーバー上のファイルより大きい等) → 最初から
+        response.close()
+        part_path.unlink()
+        offset = 0
+        response = session.get(url, stream=True, timeout=timeout)
+
+    with response:
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            offset = 0  # サーバーが Range 非対応なら最初から
+
+        length = response.headers.get("Content-Length")
+        total = offset + int(length) if length is not None else None
+
+        # 既にある分のハッシュを先に計算して、続きを足し込む
+        digest = hashlib.sha256()
+        if offset:
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+
+        done = offset
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(save_path.name, done, total)
+
+    if total is not None and done != total:
+        raise IOError(f"Incomplete download: {done}/{total} bytes (resumable)")
+
+    os.replace(part_path, save_path)
+    return {"url": url, "size": done, "sha256": digest.hexdigest()}
+
+
+def _is_complete(save_path, entry, url, verify=False):
+    if not save_path.exists() or not entry or entry.get("url") != url:
+        return False
+    if save_path.stat().st_size != entry.get("size"):
+        return False
+    return not verify or file_hash(save_path) == entry.get("sha256")
+
+
+def _adopt_existing(session, url, save_path, timeout=30):
+    """
+    マニフェスト導入前からあるファイル: サーバー上のサイズと一致すれば完成品として登録
+    """
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+    except requests.RequestException:
+        return None
+    if length is None or int(length) != save_path.stat().st_size:
+        return None
+    return {"url": url, "size": save_path.stat().st_size, "sha256": file_hash(save_path)}
+
+
+def download_bgm(force=False, sources=None, base_path="assets/bgm", workers=DEFAULT_WORKERS, progress=None, verify=False, session=None):
+    """
+    BGMを並列ダウンロードする (途中再開・SHA-256マニフェスト・完了時にアトミックにリネーム)
+    progress(name, done_bytes, total_bytes) で進捗を受け取れる
+    Returns: {"downloaded": [...], "skipped": [...], "failed": {name: error}}
+    """
+    sources = BGM_SOURCES if sources is None else sources
+    base_path = Path(base_path)
+    base_path.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(base_path)
+    manifest_lock = threading.Lock()
+    session = session or make_session(pool_size=workers)
+    result = {"downloaded": [], "skipped": [], "failed": {}}
+
     print("🚀 Starting reliable BGM download from GitHub...")
 
-    for genre, tracks in BGM_SOURCES.items():
-        genre_path = base_path / genre
-        genre_path.mkdir(parents=True, exist_ok=True)
-        
-        for filename, url in tracks.items():
-            save_path = genre_path / filename
-            
-            if save_path.exists() and not force:
-                print(f"✅ Already exists: {genre}/{filename}")
-                continue
-            
-            print(f"⬇ Downloading [{genre}] {filename}...")
+    def sync_track(rel, url, save_path):
+        entry = manifest.get(rel)
+        if force:
+            save_path.with_name(save_path.name + ".part").unlink(missing_ok=True)
+        elif _is_complete(save_path, entry, url, verify=verify):
+            return "skipped", entry
+        elif save_path.exists() and entry is None:
+            adopted = _adopt_existing(session, url, save_path)
+            if adopted:
+                return "skipped", adopted
+
+        print(f"⬇ Downloading [{rel}]...")
+        return "downloaded", download_file(session, url, save_path, progress=progress)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for genre, tracks in sources.items():
+            genre_path = base_path / genre
+            genre_path.mkdir(parents=True, exist_ok=True)
+            for filename, url in tracks.items():
+                rel = f"{genre}/{filename}"
+                futures[pool.submit(sync_track, rel, url, genre_path / filename)] = rel
+
+        for future in as_completed(futures):
+            rel = futures[future]
             try:
-                response = requests.get(url, headers=HEADERS, stream=True, timeout=30)
-                response.raise_for_status()
-                
-                with open(save_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                print(f"✨ Downloaded: {filename}")
-                # Small delay to prevent rate limits
-                time.sleep(0.5)
+                status, entry = future.result()
             except Exception as e:
-                print(f"❌ Failed to download {filename}: {e}")
+                print(f"❌ Failed to download {rel}: {e}")
+                result["failed"][rel] = str(e)
+                continue
+
+            if status == "skipped":
+                print(f"✅ Already exists: {rel}")
+            else:
+                print(f"✨ Downloaded: {rel} ({entry['size'] // 1024} KB)")
+            result[status].append(rel)
+            with manifest_lock:
+                manifest[rel] = entry
+                save_manifest(base_path, manifest)
+
+    return result
 
 if __name__ == "__main__":
     download_bgm()
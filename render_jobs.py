@@ -0,0 +1,154 @@
+import time
+import uuid
+import threading
+import traceback
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+MAX_FINISHED_JOBS = 20  # 終わったジョブを何件まで覚えておくか
+
+# job_id -> RenderJob (Streamlit の再実行をまたいでプロセス内で共有)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class RenderCancelled(Exception):
+    """
+    cancel() されたジョブの進捗コールバックから投げて書き出しを止める
+    """
+
+
+class RenderJob:
+    """
+    バックグラウンドで1本書き出すジョブ (進捗・ETA・キャンセル)
+    """
+
+    def __init__(self, fn, kwargs, label=""):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._fn = fn
+        self._kwargs = kwargs
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"render-{self.id}", daemon=True)
+
+    def _progress(self, done, total):
+        if self._cancel.is_set():
+            raise RenderCancelled(self.id)
+        self.done, self.total = done, total
+
+    def _run(self):
+        self.status = RUNNING
+        self.started = time.time()
+        try:
+            self.result = self._fn(progress=self._progress, **self._kwargs)
+            self.status = DONE
+        except RenderCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.traceback = traceback.format_exc()
+            self.status = FAILED
+        finally:
+            self.finished = time.time()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """
+        次のフレームの書き出し前に止める (すぐには止まらない)
+        """
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """
+        ジョブのスレッドが終わるまで待つ。timeout 秒以内に終わったら True
+        """
+        self._thread.join(timeout)
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancelling(self):
+        return self._cancel.is_set() and self.status not in FINISHED_STATES
+
+    @property
+    def fraction(self):
+        if self.status == DONE:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def eta(self):
+        """
+        残り秒数の見積もり (まだ測れなければ None)
+        """
+        if self.status != RUNNING or not self.done or not self.total:
+            return None
+        # 最初のフレームまでの準備時間も含めた平均なので少し多めに出る
+        return self.elapsed / self.done * (self.total - self.done)
+
+    def snapshot(self):
+        return {
+            "id": self.id, "label": self.label, "status": self.status,
+            "done": self.done, "total": self.total, "fraction": self.fraction,
+            "elapsed": self.elapsed, "eta": self.eta(), "result": self.result, "error": self.error,
+        }
+
+
+def _forget_old_jobs():
+    finished = sorted((j for j in _jobs.values() if j.status in FINISHED_STATES), key=lambda j: j.created)
+    for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job.id]
+
+
+def start_render(fn, label="", **kwargs):
+    """
+    fn(progress=..., **kwargs) を別スレッドで実行し、ジョブIDを返す
+    fn は video_utils.generate_reel / generate_preview など progress を受け取る関数
+    """
+    job = RenderJob(fn, kwargs, label=label)
+    with _jobs_lock:
+        _forget_old_jobs()
+        _jobs[job.id] = job
+    job.start()
+    return job.id
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is not None:
+        job.cancel()
+    return job
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(round(seconds))
+    return f"{seconds // 60:d}:{seconds % 60:02d}"
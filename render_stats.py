@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+try:
+    import resource  # Unix のみ
+except ImportError:
+    resource = None
+
+# フレームごとの所要時間ヒストグラムの区切り (ミリ秒)
+LATENCY_BUCKETS_MS = (5, 10, 20, 33, 50, 100, 200, 500)
+
+RSS_SAMPLE_EVERY = 10  # 何フレームごとに現在のメモリを測るか
+
+
+def peak_rss_mb():
+    """
+    このプロセスの最大常駐メモリ (MB)。測れない環境では None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def process_rss_mb(pid="self"):
+    """
+    プロセスの現在の常駐メモリ (MB)。/proc がない環境では None
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def current_rss_mb():
+    """
+    このプロセスの現在の常駐メモリ (MB)。/proc がなければ最大値で代用
+    """
+    rss = process_rss_mb()
+    return rss if rss is not None else peak_rss_mb()
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """
+    max_rss_mb を超えた (または超えると見込まれる) ので書き出しを止めた
+    """
+
+
+class MemoryBudget:
+    """
+    書き出し中のメモリ (このプロセス + ffmpeg) を見張り、上限を超えたら MemoryBudgetExceeded を投げる
+    OOM Killer に落とされる前に、どこで足りなくなったか分かるエラーで止めるためのもの
+    """
+
+    def __init__(self, max_rss_mb, check_every=10):
+        self.max_rss_mb = max_rss_mb
+        self.check_every = check_every  # フレームごとの確認間隔
+        self.peak_mb = 0.0
+
+    def usage_mb(self, pids=()):
+        total = current_rss_mb() or 0.0
+        for pid in pids:
+            total += process_rss_mb(pid) or 0.0
+        return total
+
+    def check(self, where, pids=(), extra_mb=0.0):
+        """
+        現在の使用量 + これから確保する見込み extra_mb が上限を超えるなら止める
+        """
+        usage = self.usage_mb(pids)
+        self.peak_mb = max(self.peak_mb, usage)
+        if usage + extra_mb > self.max_rss_mb:
+            detail = f" + 見込み {extra_mb:.0f}MB" if extra_mb else ""
+            raise MemoryBudgetExceeded(
+                f"メモリ上限 {self.max_rss_mb:.0f}MB を超えるため中断しました ({where}: 使用中 {usage:.0f}MB{detail})。"
+                f"解像度を下げるか、画質をドラフトにしてください"
+            )
+        return usage
+
+    def to_dict(self):
+        return {"max_rss_mb": self.max_rss_mb, "peak_observed_mb": round(self.peak_mb, 1)}
+
+
+def latency_summary(samples):
+    """
+    秒の配列 -> 件数・平均・パーセンタイル・ヒストグラム (ミリ秒)
+    """
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    edges = (0,) + LATENCY_BUCKETS_MS + (np.inf,)
+    counts, _ = np.histogram(ms, bins=edges)
+    labels = [f"<{b}ms" for b in LATENCY_BUCKETS_MS] + [f">={LATENCY_BUCKETS_MS[-1]}ms"]
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "max_ms": float(ms.max()),
+        "histogram": dict(zip(labels, counts.tolist())),
+    }
+
+
+class RenderStats:
+    """
+    1回の書き出しの計測 (工程ごとの経過/CPU時間、フレームごとの所要時間、最大メモリ)
+    最大メモリは書き出し中に測った現在値の最大 (ru_maxrss は起動からの最大なので、常駐する Streamlit では前の書き出しの値が残る)
+    """
+
+    def __init__(self, label=""):
+        self.label = label
+        self.stages = {}  # name -> {"wall": 秒, "cpu": 秒 or None, "calls": 回数}
+        self.frame_times = []   # get_frame 1回の秒数
+        self.encode_times = []  # ffmpeg への書き込み1回の秒数
+        self.info = {}
+        self.workers = []       # 並列書き出し時の子プロセスの計測
+        self.peak_rss = None    # この書き出し中に測った常駐メモリの最大 (MB)
+        self._started = time.perf_counter()
+        self._finished = None
+
+    def add(self, name, wall, cpu=None, calls=1):
+        """
+        cpu を測っていない工程 (フレームごとの細かい計測) は cpu=None のまま
+        """
+        st = self.stages.setdefault(name, {"wall": 0.0, "cpu": None, "calls": 0})
+        st["wall"] += wall
+        if cpu is not None:
+            st["cpu"] = (st["cpu"] or 0.0) + cpu
+        st["calls"] += calls
+
+    def sample_memory(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0.0, rss)
+
+    @contextmanager
+    def stage(self, name):
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall0, time.thread_time() - cpu0)
+            self.sample_memory()
+
+    def record_frame(self, render_seconds, encode_seconds):
+        self.frame_times.append(render_seconds)
+        self.encode_times.append(encode_seconds)
+        if len(self.frame_times) % RSS_SAMPLE_EVERY == 1:
+            self.sample_memory()
+
+    def merge(self, report):
+        """
+        別プロセスの to_dict() を取り込む (工程とフレーム時間は合算)
+        """
+        for name, st in report.get("stages", {}).items():
+            self.add(name, st["wall"], st["cpu"], st["calls"])
+        self.frame_times.extend(report.get("_frame_times", []))
+        self.encode_times.extend(report.get("_encode_times", []))
+        self.workers.append({"label": report.get("label"), "wall": report.get("wall"), "peak_rss_mb": report.get("peak_rss_mb")})
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        return self
+
+    def to_dict(self, raw=False):
+        """
+        JSONにできる計測結果。raw=True なら merge 用にフレームごとの生データも含める
+        """
+        wall = (self._finished or time.perf_counter()) - self._started
+        self.sample_memory()
+        report = {
+            "label": self.label,
+            "wall": wall,
+            "stages": {k: dict(v) for k, v in sorted(self.stages.items(), key=lambda kv: -kv[1]["wall"])},
+            "get_frame": latency_summary(self.frame_times),
+            "encode_write": latency_summary(self.encode_times),
+            "peak_rss_mb": self.peak_rss,
+            "process_peak_rss_mb": peak_rss_mb(),  # プロセス起動からの最大 (前の書き出しも含む)
+            "info": dict(self.info, python=platform.python_version(), cpu_count=os.cpu_count()),
+        }
+        if self.workers:
+            report["workers"] = self.workers
+            worker_rss = [w["peak_rss_mb"] for w in self.workers if w["peak_rss_mb"] is not None]
+            if worker_rss:
+                report["peak_worker_rss_mb"] = max(worker_rss)
+        if raw:
+            report["_frame_times"] = list(self.frame_times)
+            report["_encode_times"] = list(self.encode_times)
+        return report
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+def stage(stats, name):
+    """
+    stats が None なら何もしない with 用ヘルパー
+    """
+    return stats.stage(name) if stats is not None else nullcontext()
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import batch_render
+
+
+def write_manifest(path, *jobs):
+    path.write_text("\n".join(json.dumps(job) for job in jobs) + "\n", encoding="utf-8")
+    return path
+
+
+def test_resolves_paths_from_manifest_folder(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"jpg")
+    (tmp_path / "bgm.mp3").write_bytes(b"mp3")
+    manifest = write_manifest(
+        tmp_path / "jobs.jsonl",
+        {"id": "k1", "images": ["a.jpg"], "preset": "Food_Luxury", "bgm": "bgm.mp3", "output": "out/k1.mp4"},
+    )
+
+    [job] = batch_render.load_jobs(manifest)
+
+    assert job["images"] == [str(tmp_path / "a.jpg")]
+    assert job["bgm"] == str(tmp_path / "bgm.mp3")
+    assert job["output"] == str(tmp_path / "out" / "k1.mp4")
+    assert job["logo"] == "assets/logo.png"
+
+
+@pytest.mark.parametrize("missing", ["images", "bgm", "logo"])
+def test_rejects_missing_input_files(tmp_path, missing):
+    (tmp_path / "a.jpg").write_bytes(b"jpg")
+    (tmp_path / "bgm.mp3").write_bytes(b"mp3")
+    (tmp_path / "logo.png").write_bytes(b"png")
+    job = {"images": ["a.jpg"], "preset": "Food_Luxury", "bgm": "bgm.mp3", "logo": "logo.png", "output": "k1.mp4"}
+    job[missing] = ["nope.jpg"] if missing == "images" else "assets/nope"
+    manifest = write_manifest(tmp_path / "jobs.jsonl", {"id": "ok", "images": ["a.jpg"], "preset": "Food_Luxury", "output": "ok.mp4"}, job)
+
+    with pytest.raises(ValueError, match=r"jobs\.jsonl:2: file not found"):
+        batch_render.load_jobs(manifest)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import download_bgm
+
+TRACK = bytes(range(256)) * 1024  # 256KB (CHUNK_SIZE より大きい)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    server.files のバイト列を返す (Range: bytes=N- に対応、範囲外は 416)
+    受け取ったリクエストは server.requests に (メソッド, パス, Range) で記録する
+    """
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        data = self.server.files.get(self.path)
+        range_header = self.headers.get("Range")
+        self.server.requests.append((self.command, self.path, range_header))
+        if data is None:
+            self.send_error(404)
+            return
+
+        status, start = 200, 0
+        if range_header:
+            start = int(re.fullmatch(r"bytes=(\d+)-", range_header).group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        body = data[start:]
+        self.send_response(status)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.files = {"/track.mp3": TRACK}
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_resumes_from_partial_file(server, tmp_path):
+    save_path = tmp_path / "track.mp3"
+    (tmp_path / "track.mp3.part").write_bytes(TRACK[:100000])
+
+    entry = download_bgm.download_file(download_bgm.make_session(), server.url + "/track.mp3", save_path)
+
+    assert server.requests == [("GET", "/track.mp3", "bytes=100000-")]
+    assert save_path.read_bytes() == TRACK
+    assert not (tmp_path / "track.mp3.part").exists()
+    assert entry == {"url": server.url + "/track.mp3", "size": len(TRACK), "sha256": hashlib.sha256(TRACK).hexdigest()}
+
+
+def test_restarts_when_partial_file_is_out_of_range(server, tmp_path):
+    save_path = tmp_path / "track.mp3"
+    (tmp_path / "track.mp3.part").write_bytes(b"x" * (len(TRACK) + 10))
+
+    entry = download_bgm.download_file(download_bgm.make_session(), server.url + "/track.mp3", save_path)
+
+    assert server.requests == [
+        ("GET", "/track.mp3", f"bytes={len(TRACK) + 10}-"),
+        ("GET", "/track.mp3", None),
+    ]
+    assert save_path.read_bytes() == TRACK
+    assert entry["sha256"] == hashlib.sha256(TRACK).hexdigest()
+
+
+def test_adopts_legacy_file_without_downloading(server, tmp_path):
+    (tmp_path / "Pop").mkdir()
+    (tmp_path / "Pop" / "track.mp3").write_bytes(TRACK)
+    sources = {"Pop": {"track.mp3": server.url + "/track.mp3"}}
+
+    result = download_bgm.download_bgm(sources=sources, base_path=tmp_path, workers=1)
+
+    assert result == {"downloaded": [], "skipped": ["Pop/track.mp3"], "failed": {}}
+    assert [method for method, _, _ in server.requests] == ["HEAD"]
+    manifest = json.loads((tmp_path / download_bgm.MANIFEST_NAME).read_text(encoding="utf-8"))
+    assert manifest["Pop/track.mp3"]["sha256"] == hashlib.sha256(TRACK).hexdigest()
+
+    # 2回目はマニフェストだけで完成品と分かるので、サーバーには問い合わせない
+    server.requests.clear()
+    result = download_bgm.download_bgm(sources=sources, base_path=tmp_path, workers=1)
+    assert result["skipped"] == ["Pop/track.mp3"]
+    assert server.requests == []
+
+
+def test_redownloads_legacy_file_with_wrong_size(server, tmp_path):
+    (tmp_path / "Pop").mkdir()
+    (tmp_path / "Pop" / "track.mp3").write_bytes(TRACK[:1000])
+    sources = {"Pop": {"track.mp3": server.url + "/track.mp3"}}
+
+    result = download_bgm.download_bgm(sources=sources, base_path=tmp_path, workers=1)
+
+    assert result["downloaded"] == ["Pop/track.mp3"]
+    assert [method for method, _, _ in server.requests] == ["HEAD", "GET"]
+    assert (tmp_path / "Pop" / "track.mp3").read_bytes() == TRACK
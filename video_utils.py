@@ -1,150 +1,768 @@
 
+import io
 import os
-import random
+import re
+import base64
+import json
+import math
+import time
+import bisect
+import gc
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from PIL import Image, ImageFilter, ImageDraw, ImageFont, ImageOps
-from moviepy.editor import (
-    ImageClip, CompositeVideoClip, ColorClip, VideoClip, AudioFileClip,
-    vfx, transfx, concatenate_videoclips
-)
-from moviepy.video.fx.all import crop, resize
+from moviepy.editor import ImageClip, VideoClip
+from moviepy.config import get_setting
 from pilmoji import Pilmoji
-# Try import audio_loop
-try:
-    from moviepy.audio.fx.all import audio_loop
-except ImportError:
-    # Fallback for older moviepy
-    audio_loop = None
+from pilmoji.source import BaseSource, Twemoji
+import audio_utils
+from cache_utils import LRUCache, DiskCache, content_hash, data_hash, file_signature, file_hash
+from render_stats import RenderStats, MemoryBudget, stage
 
 DEFAULT_FONT = "arial.ttf" # Windows standard
 ASSETS_DIR = "assets"
 
+FPS = 30
+FADEOUT_DURATION = 3.0  # 動画・BGMの終わりのフェードアウト (秒)
+WATERMARK_OPACITY = 0.3
+
 # Monkey-patch: Fix MoviePy compatibility with Pillow 10+
 if not hasattr(Image, 'ANTIALIAS'):
     Image.ANTIALIAS = Image.LANCZOS
 
+# ============================================================
+# 🖼️ Image Loader
+# ============================================================
+
+MAX_SOURCE_ZOOM = 1.5  # 読み込み時に確保するズーム余裕の上限
+
+def load_image(img_path, target_size=(1080, 1920), max_zoom=1.0):
+    """
+    画像を読み込み、EXIF回転と縮小を済ませた (H, W, 3) 配列を返す
+    JPEGはdraftモードでデコード時に縮小し、出力解像度 × max_zoom 以上は保持しない
+    """
+    with Image.open(img_path) as pil_img:
+        rotated, need_w, need_h = _prepare_decode(pil_img, target_size, max_zoom)
+        pil_img = ImageOps.exif_transpose(pil_img)
+        pil_img = pil_img.convert("RGB")
+
+    # JPEG以外: 整数倍の縮小で大まかに落としてから1回だけリサンプル
+    factor = min(pil_img.width // need_w, pil_img.height // need_h)
+    if factor >= 2:
+        pil_img = pil_img.reduce(factor)
+    if pil_img.size != (need_w, need_h):
+        pil_img = pil_img.resize((need_w, need_h), Image.LANCZOS)
+
+    return np.asarray(pil_img)
+
+
+def _prepare_decode(pil_img, target_size, max_zoom):
+    """
+    EXIF回転後の向きで必要サイズを計算し、JPEGならdraftを設定する (まだデコードはしない)
+    (回転しているか, 必要な幅, 必要な高さ) を返す
+    """
+    target_w, target_h = target_size
+    rotated = pil_img.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+    w, h = pil_img.size
+    if rotated:
+        w, h = h, w
+
+    scale = min(1.0, max(target_w / w, target_h / h) * max(max_zoom, 1.0))
+    need_w = max(1, math.ceil(w * scale))
+    need_h = max(1, math.ceil(h * scale))
+
+    # JPEG: DCT段階で 1/2, 1/4, 1/8 に縮小してデコード
+    pil_img.draft("RGB", (need_h, need_w) if rotated else (need_w, need_h))
+    return rotated, need_w, need_h
+
+
+def decode_memory_estimate_mb(img_path, target_size=(1080, 1920), max_zoom=1.0):
+    """
+    load_image がデコード中に確保するメモリの見込み (MB)。ヘッダだけ読むので画素はデコードしない
+    デコードした画像 (JPEGはdraft後のサイズ) + RGB変換 + EXIF回転のコピー
+    """
+    with Image.open(img_path) as pil_img:
+        if pil_img.format in ("JPEG", "MPO"):
+            rotated, _, _ = _prepare_decode(pil_img, target_size, max_zoom)
+        else:
+            # PNG などは getexif が画素までデコードしてしまうので読まず、回転ありとして多めに見積もる
+            rotated = True
+        w, h = pil_img.size
+        channels = len(pil_img.getbands()) + 3 + (3 if rotated else 0)
+    return w * h * channels / (1024 * 1024)
+
 # ============================================================
 # 📐 Aspect Ratio & Layout
 # ============================================================
 
-def resize_with_blur(clip, target_size=(1080, 1920)):
+BLUR_DOWNSCALE = 8     # ブラー背景は 1/8 に縮小してからぼかす
+BLUR_RADIUS = 6        # 縮小後の画像に対するガウスぼかし半径
+BLUR_BRIGHTNESS = 0.4  # 背景の明るさ (旧 colorx 0.4 相当)
+
+
+def flatten_layout(img_array, target_size=(1080, 1920)):
     """
-    画像が9:16でない場合、背景にブラー画像を配置して余白を埋める
+    ブラー背景 + 前景を1枚のNumPy配列 (H, W, 3) に焼き込む (静的レイヤーの平坦化)
+    アスペクト比がほぼ一致する場合は中央クロップのみ
     """
-    w, h = clip.size
+    src = Image.fromarray(img_array).convert("RGB")
+    w, h = src.size
     target_w, target_h = target_size
-    
-    # アスペクト比計算
+
     img_ratio = w / h
     target_ratio = target_w / target_h
-    
+
+    # 画面いっぱいに拡大した時の中央クロップ範囲 (cover)
+    cover = max(target_w / w, target_h / h)
+    cw, ch = min(w, target_w / cover), min(h, target_h / cover)  # 丸め誤差で元画像をはみ出さないように
+    box = ((w - cw) / 2, (h - ch) / 2, (w + cw) / 2, (h + ch) / 2)
+
     # ほぼ一致ならリサイズしてクロップ
     if abs(img_ratio - target_ratio) < 0.05:
-        if img_ratio > target_ratio:
-            return clip.resize(height=target_h).crop(x1=(clip.w*target_h/clip.h - target_w)/2, width=target_w, height=target_h)
-        else:
-            return clip.resize(width=target_w).crop(y1=(clip.h*target_w/clip.w - target_h)/2, width=target_w, height=target_h)
+        return np.asarray(src.resize(target_size, Image.LANCZOS, box=box))
+
+    # 背景: 縮小コピーにガウスぼかし → 拡大して暗くする
+    small_w = max(1, target_w // BLUR_DOWNSCALE)
+    small_h = max(1, target_h // BLUR_DOWNSCALE)
+    bg = src.resize((small_w, small_h), Image.BILINEAR, box=box, reducing_gap=2.0)
+    bg = bg.filter(ImageFilter.GaussianBlur(BLUR_RADIUS))
+    bg = bg.point(lambda v: int(v * BLUR_BRIGHTNESS))
+    bg = bg.resize(target_size, Image.BILINEAR)
+
+    # 前景: 画面内に収まるように縮小 (contain) して中央に配置
+    contain = min(target_w / w, target_h / h)
+    main_w = max(1, round(w * contain))
+    main_h = max(1, round(h * contain))
+    main = src.resize((main_w, main_h), Image.LANCZOS, reducing_gap=3.0)
+    bg.paste(main, ((target_w - main_w) // 2, (target_h - main_h) // 2))
+
+    return np.asarray(bg)
+
+
+def resize_with_blur(clip, target_size=(1080, 1920)):
+    """
+    画像が9:16でない場合、背景にブラー画像を配置して余白を埋める
+    (flatten_layout で1フレームに焼き込んだ ImageClip を返す)
+    """
+    frame = flatten_layout(clip.get_frame(0), target_size=target_size)
+    clip_out = ImageClip(frame)
+    if clip.duration is not None:
+        clip_out = clip_out.set_duration(clip.duration)
+    return clip_out
+
+# ============================================================
+# 🗂️ Scene Assets
+# ============================================================
+
+SCENE_CACHE_VERSION = 1  # load_image / flatten_layout を変えたら上げる
+
+# アップロード画像 (中身の SHA-256 がファイル名) と、平坦化済みフレーム (メモリLRU + ディスク .npy)
+_upload_cache = DiskCache("uploads", max_bytes=1024 * 1024 * 1024)
+_scene_memory_cache = LRUCache(max_items=32, max_bytes=512 * 1024 * 1024)
+_scene_disk_cache = DiskCache("scenes", max_bytes=2 * 1024 * 1024 * 1024)
+# (パス, mtime, サイズ) -> 中身の SHA-256 (同じファイルを何度も読まない)
+_content_hashes = LRUCache(max_items=256)
+
+
+def store_upload(data, filename):
+    """
+    アップロードされたバイト列を中身のハッシュ名で保存してパスを返す
+    (同じ写真なら何度 Generate しても同じパス・1回だけ書き込み)
+    """
+    key = data_hash(data)
+    ext = os.path.splitext(filename)[1].lower()
+    path = _upload_cache.get_path(key, ext)
+    if path is None:
+        path = _upload_cache.write(key, ext, lambda tmp: _write_bytes(tmp, data))
+    _content_hashes.put(file_signature(path), key)
+    return path
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+THUMBNAIL_SIZE = 360     # シーン一覧のサムネイルの長辺 (px)
+THUMBNAIL_QUALITY = 80
+_thumb_memory_cache = LRUCache(max_items=64, max_bytes=16 * 1024 * 1024)
+_thumb_disk_cache = DiskCache("thumbs", max_bytes=64 * 1024 * 1024)
+
+
+def make_thumbnail(data, max_side=THUMBNAIL_SIZE):
+    """
+    画像のバイト列から EXIF回転済み・長辺 max_side の JPEG バイト列を作る
+    """
+    with Image.open(io.BytesIO(data)) as pil_img:
+        pil_img.draft("RGB", (max_side, max_side))  # JPEGならデコード時に縮小
+        pil_img = ImageOps.exif_transpose(pil_img)
+        if pil_img.mode in ("RGBA", "LA", "P"):
+            pil_img = pil_img.convert("RGBA")
+            flat = Image.new("RGB", pil_img.size, (0, 0, 0))
+            flat.paste(pil_img, mask=pil_img.getchannel("A"))
+            pil_img = flat
+        pil_img = pil_img.convert("RGB")
+        pil_img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+        out = io.BytesIO()
+        pil_img.save(out, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return out.getvalue()
 
-    # 縦長すぎる or 横長すぎる場合
-    if img_ratio > target_ratio:
-        # 横長: 幅を合わせて上下に黒帯(ブラー)
-        main = clip.resize(width=target_w)
+
+def get_thumbnail_data_uri(data, max_side=THUMBNAIL_SIZE):
+    """
+    <img src=...> にそのまま使える data URI (アップロードの中身ごとに1回だけ作る)
+    """
+    key = content_hash(SCENE_CACHE_VERSION, data_hash(data), max_side)
+    uri = _thumb_memory_cache.get(key)
+    if uri is not None:
+        return uri
+
+    path = _thumb_disk_cache.get_path(key, ".jpg")
+    if path is not None:
+        with open(path, "rb") as f:
+            jpeg = f.read()
     else:
-        # 縦長: 高さを合わせて左右に黒帯(ブラー)
-        main = clip.resize(height=target_h)
-        
-    # 背景: 画面いっぱいに拡大してブラー (簡易的に暗くする)
-    bg = clip.resize(height=target_h if img_ratio > target_ratio else target_w * 2)
-    bg = bg.crop(x_center=bg.w/2, y_center=bg.h/2, width=target_w, height=target_h)
-    bg = bg.fx(vfx.colorx, 0.4) # 暗くする
-    
-    return CompositeVideoClip([bg.set_position("center"), main.set_position("center")], size=target_size)
+        jpeg = make_thumbnail(bytes(data), max_side)
+        try:
+            _thumb_disk_cache.write(key, ".jpg", lambda tmp: _write_bytes(tmp, jpeg))
+        except OSError as e:
+            print(f"Thumbnail cache write failed: {e}")
+
+    uri = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+    _thumb_memory_cache.put(key, uri, nbytes=len(uri))
+    return uri
+
+
+def cached_file_hash(img_path):
+    signature = file_signature(img_path)
+    digest = _content_hashes.get(signature)
+    if digest is None:
+        digest = file_hash(img_path)
+        _content_hashes.put(signature, digest)
+    return digest
+
+
+def get_scene_frame(img_path, target_size, max_zoom=1.0, stats=None):
+    """
+    load_image → flatten_layout のキャッシュ付き版
+    (画像の中身, 出力サイズ, ズーム) が同じなら、向き補正・縮小・ブラー背景まで済んだフレームを再利用する
+    """
+    flat_size = _flat_size(target_size, max_zoom)
+    with stage(stats, "scene_cache"):
+        key = _scene_key(img_path, target_size, flat_size)
+        frame = _scene_memory_cache.get(key)
+        if frame is None:
+            frame = _scene_disk_cache.load_array(key)
+
+    if frame is None:
+        # 1. 画像読み込み & EXIF回転 (出力サイズに必要な分だけデコード)
+        with stage(stats, "image_decode"):
+            img_array = load_image(img_path, target_size=target_size, max_zoom=max_zoom)
+
+        # 2. アスペクト比調整 (ブラー背景ごと1枚に平坦化、ズーム分だけオーバーサンプリング)
+        with stage(stats, "layout_blur"):
+            frame = flatten_layout(img_array, target_size=flat_size)
+        del img_array
+        try:
+            _scene_disk_cache.save_array(key, frame)
+        except OSError as e:
+            print(f"Scene cache write failed: {e}")
+
+    if key not in _scene_memory_cache:
+        frame.setflags(write=False)  # 共有するので書き換え禁止
+        _scene_memory_cache.put(key, frame)
+    return frame
+
+
+def _flat_size(target_size, max_zoom):
+    return (round(target_size[0] * max_zoom), round(target_size[1] * max_zoom))
+
+
+def _scene_key(img_path, target_size, flat_size):
+    return content_hash(SCENE_CACHE_VERSION, cached_file_hash(img_path), tuple(target_size), flat_size)
+
+
+def scene_frame_cached(img_path, target_size, max_zoom=1.0):
+    """
+    get_scene_frame が画像をデコードせずにキャッシュから返せるか
+    """
+    key = _scene_key(img_path, target_size, _flat_size(target_size, max_zoom))
+    return key in _scene_memory_cache or os.path.exists(_scene_disk_cache.path(key, ".npy"))
 
 # ============================================================
 # 🎬 Animations
 # ============================================================
 
-def apply_animation(clip, animation_type, duration):
+# 1フレーム分の変換
+#   zoom:    拡大率 (>= 1)
+#   pan_x/y: 拡大後の切り出し窓の中心ずれ (出力サイズ比)
+#   shift_x/y: フレーム全体の平行移動 (出力サイズ比、はみ出しは黒)
+#   gain:    明るさ (フェード用)
+Transform = namedtuple("Transform", "zoom pan_x pan_y shift_x shift_y gain", defaults=(1.0, 0.0, 0.0, 0.0, 0.0, 1.0))
+
+IDENTITY = Transform()
+
+MOTION_RESAMPLE = Image.BILINEAR   # 動いているフレーム用 (高速)
+STILL_RESAMPLE = Image.LANCZOS     # 静止フレーム用 (高画質)
+
+
+def _slide_in(t, length):
+    return min(0.0, t / length - 1.0)
+
+
+def _fade_in(t, length):
+    return min(1.0, t / length)
+
+
+# config.PRESETS の animation 名 -> (t, duration) -> Transform
+ANIMATIONS = {
+    "zoom_in_crossfade": lambda t, d: Transform(zoom=1 + 0.05 * t),
+    "zoom_center_impact": lambda t, d: Transform(zoom=1 + 0.3 * t),
+    "zoom_face_text": lambda t, d: Transform(zoom=1 + 0.08 * t),
+    "slide_in_left": lambda t, d: Transform(shift_x=_slide_in(t, 0.5)),
+    "slide_in_vertical": lambda t, d: Transform(shift_y=_slide_in(t, 0.5)),
+    "slide_fast_tint": lambda t, d: Transform(shift_x=_slide_in(t, 0.25)),
+    "pan_horizontal": lambda t, d: Transform(zoom=1.2, pan_x=-0.05 * t),
+    "soft_pan": lambda t, d: Transform(zoom=1.1, pan_y=-0.02 * t),
+    "fast_cut_shake": lambda t, d: Transform(zoom=1.05, pan_x=0.015 * np.sin(t * 45), pan_y=0.015 * np.cos(t * 37)),
+    "flash_cut": lambda t, d: Transform(gain=_fade_in(t, 0.1)),
+    "static_fade": lambda t, d: Transform(gain=_fade_in(t, 0.3)),
+    "slow_dissolve": lambda t, d: Transform(zoom=1 + 0.02 * t, gain=_fade_in(t, 1.0)),
+    "fade_dark": lambda t, d: Transform(gain=_fade_in(t, 0.6)),
+    "pulse_zoom": lambda t, d: Transform(zoom=1 + 0.05 * abs(np.sin(t * 3))),
+    "bounce_zoom": lambda t, d: Transform(zoom=1 + 0.1 * abs(np.sin(t * 5))),
+}
+
+
+def get_transform(animation_type, t, duration):
+    transform_fn = ANIMATIONS.get(animation_type)
+    if transform_fn is None:
+        return IDENTITY
+    return transform_fn(t, duration)
+
+
+def animation_max_zoom(animation_type, duration, samples=64):
     """
-    config.py で定義されたアニメーションタイプに応じてエフェクトを適用
+    アニメーション中の最大拡大率 (MAX_SOURCE_ZOOM で頭打ち)
     """
-    clip = clip.set_duration(duration)
-    w, h = clip.size
-    
-    if animation_type == "zoom_in_crossfade":
-        return clip.resize(lambda t: 1 + 0.05 * t)
-        
-    elif animation_type == "zoom_center_impact":
-        return clip.resize(lambda t: 1 + 0.3 * t)
-        
-    elif animation_type == "slide_in_left":
-        return clip.set_position(lambda t: (min(0, int(w * (t/0.5 - 1))), "center") if t < 0.5 else "center")
-        
-    elif animation_type == "slide_in_vertical":
-        return clip.set_position(lambda t: ("center", min(0, int(h * (t/0.5 - 1)))) if t < 0.5 else "center")
-    
-    elif animation_type == "pan_horizontal":
-        clip = clip.resize(1.2)
-        return clip.set_position(lambda t: (int(-0.1*w + 0.05*w*t), "center"))
-        
-    elif animation_type == "soft_pan":
-        clip = clip.resize(1.1)
-        return clip.set_position(lambda t: ("center", int(-0.05*h + 0.02*h*t)))
-        
-    elif animation_type == "flash_cut":
-        return clip.fx(vfx.fadein, 0.1)
-        
-    elif animation_type == "pulse_zoom":
-        return clip.resize(lambda t: 1 + 0.05 * abs(np.sin(t * 3)))
-        
-    elif animation_type == "bounce_zoom":
-        return clip.resize(lambda t: 1 + 0.1 * abs(np.sin(t * 5)))
+    if animation_type not in ANIMATIONS:
+        return 1.0
+    zoom = max(get_transform(animation_type, t, duration).zoom for t in np.linspace(0, duration, samples))
+    return min(max(zoom, 1.0), MAX_SOURCE_ZOOM)
+
+
+def _shift_frame(frame, dx, dy):
+    """
+    フレームを (dx, dy) ピクセル平行移動し、空いた部分を黒で埋める
+    """
+    h, w = frame.shape[:2]
+    if abs(dx) >= w or abs(dy) >= h:
+        return np.zeros_like(frame)
+    out = np.zeros_like(frame)
+    out[max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)] = \
+        frame[max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx)]
+    return out
+
+
+def make_animation(frame, animation_type, duration, out_size=(1080, 1920), fast_motion=True, fast_still=False):
+    """
+    1枚の (オーバーサンプリングされた) フレームから make_frame(t) を作る
+    毎フレーム、元画像から固定サイズの窓を切り出して out_size にリサンプルするだけ
+    """
+    src = Image.fromarray(frame)
+    src_w, src_h = src.size
+    out_w, out_h = out_size
+    resample = MOTION_RESAMPLE if fast_motion else STILL_RESAMPLE
+
+    # 変換なしのフレームは一度だけ高画質で作る (fast_still ならプレビュー用に高速フィルタ)
+    if src.size == tuple(out_size):
+        still = np.asarray(frame)
+    else:
+        still = np.asarray(src.resize(out_size, MOTION_RESAMPLE if fast_still else STILL_RESAMPLE, reducing_gap=2.0))
+
+    def make_frame(t):
+        tf = get_transform(animation_type, t, duration)
 
-    # Default
-    return clip
+        if tf.zoom == 1.0 and tf.pan_x == 0.0 and tf.pan_y == 0.0:
+            img = still
+        else:
+            zoom = max(tf.zoom, 1.0)
+            win_w, win_h = src_w / zoom, src_h / zoom
+            cx = src_w * (0.5 + tf.pan_x / zoom)
+            cy = src_h * (0.5 + tf.pan_y / zoom)
+            cx = min(max(cx, win_w / 2), src_w - win_w / 2)
+            cy = min(max(cy, win_h / 2), src_h - win_h / 2)
+            box = (cx - win_w / 2, cy - win_h / 2, cx + win_w / 2, cy + win_h / 2)
+            img = np.asarray(src.resize(out_size, resample, box=box))
+
+        if tf.shift_x or tf.shift_y:
+            img = _shift_frame(img, int(out_w * tf.shift_x), int(out_h * tf.shift_y))
+
+        if tf.gain < 1.0:
+            img = (img * max(tf.gain, 0.0)).astype(np.uint8)
+
+        return img
+
+    return make_frame
+
+
+def animate_frame(frame, animation_type, duration, out_size=(1080, 1920), fast_motion=True, fast_still=False):
+    """
+    make_animation の VideoClip 版
+    """
+    make_frame = make_animation(frame, animation_type, duration, out_size, fast_motion=fast_motion, fast_still=fast_still)
+    return VideoClip(make_frame, duration=duration)
+
+
+def apply_animation(clip, animation_type, duration, fast_motion=True):
+    """
+    config.py で定義されたアニメーションタイプに応じてエフェクトを適用
+    (クリップの最初のフレームを元に animate_frame で描画する)
+    """
+    return animate_frame(clip.get_frame(0), animation_type, duration, out_size=clip.size, fast_motion=fast_motion)
 
 # ============================================================
 # 💧 Watermark
 # ============================================================
 
+WATERMARK_WIDTH_RATIO = 0.15  # 画面幅に対するロゴの幅
+WATERMARK_MARGIN = 20         # 右下からのマージン (px)
+
+# (ロゴのハッシュ, 解像度, 不透明度) -> 合成用パッチ
+_watermark_cache = LRUCache(max_items=16)
+
+
+def premultiply_patch(rgba, position, canvas_size, opacity=1.0):
+    """
+    RGBA画像を乗算済みアルファのパッチ (RGB*α, 1-α) にする
+    不透明な部分の外接矩形とキャンバスの範囲に切り詰める (何も見えなければ None)
+    """
+    rgba = np.asarray(rgba)
+    x, y = position
+    canvas_w, canvas_h = canvas_size
+
+    # 透明な余白を切り落とす
+    ys, xs = np.nonzero(rgba[..., 3])
+    if len(ys) == 0 or opacity <= 0:
+        return None
+    top, bottom, left, right = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+
+    # キャンバス外を切り落とす
+    left, top = max(left, -x), max(top, -y)
+    right, bottom = min(right, canvas_w - x), min(bottom, canvas_h - y)
+    if left >= right or top >= bottom:
+        return None
+
+    patch = rgba[top:bottom, left:right].astype(np.float32)
+    alpha = patch[..., 3:4] * (opacity / 255.0)
+    return {
+        "x": x + left,
+        "y": y + top,
+        "premultiplied": patch[..., :3] * alpha + 0.5,  # +0.5 は四捨五入用
+        "inv_alpha": 1.0 - alpha,
+    }
+
+
+def prepare_watermark(logo_path, frame_size, opacity=0.3):
+    """
+    ロゴを1回だけ縮小し、右下に置く合成用パッチを作る
+    """
+    frame_w, frame_h = frame_size
+    key = (file_hash(logo_path), tuple(frame_size), round(opacity, 4))
+    if key in _watermark_cache:
+        return _watermark_cache.get(key)
+
+    with Image.open(logo_path) as logo:
+        logo = logo.convert("RGBA")
+        logo_w = max(1, min(int(frame_w * WATERMARK_WIDTH_RATIO), frame_w - WATERMARK_MARGIN))
+        logo_h = max(1, min(round(logo.height * logo_w / logo.width), frame_h - WATERMARK_MARGIN))
+        logo = logo.resize((logo_w, logo_h), Image.LANCZOS)
+
+    position = (frame_w - logo_w - WATERMARK_MARGIN, frame_h - logo_h - WATERMARK_MARGIN)
+    wm = premultiply_patch(np.asarray(logo), position, frame_size, opacity)
+    _watermark_cache.put(key, wm, nbytes=wm["premultiplied"].nbytes * 2 if wm else 0)
+    return wm
+
+
+def blend_patch(frame, patch, inplace=False):
+    """
+    パッチの矩形だけを合成する
+    inplace=True は呼び出し側が所有するバッファ (使い回しの出力バッファなど) のときだけ
+    """
+    if not inplace or not frame.flags.writeable:
+        frame = frame.copy()
+    h, w = patch["inv_alpha"].shape[:2]
+    region = frame[patch["y"]:patch["y"] + h, patch["x"]:patch["x"] + w, :3]
+    region[...] = region * patch["inv_alpha"] + patch["premultiplied"]
+    return frame
+
+
 def add_watermark(video_clip, logo_path="assets/logo.png", opacity=0.3):
-    if not os.path.exists(logo_path):
+    """
+    右下に透かしロゴを入れる (合成の計算はロゴの面積分だけ)
+    元クリップのフレームは使い回されることがあるのでコピーしてから合成する
+    """
+    if not os.path.exists(logo_path) or opacity <= 0:
         return video_clip
-        
-    logo = ImageClip(logo_path).resize(width=video_clip.w * 0.15) 
-    logo = logo.set_opacity(opacity)
-    # 右下 (マージン20px)
-    logo = logo.set_position(("right", "bottom")).set_duration(video_clip.duration).margin(right=20, bottom=20, opacity=0)
-    
-    return CompositeVideoClip([video_clip, logo], size=video_clip.size)
+
+    wm = prepare_watermark(logo_path, video_clip.size, opacity)
+    if wm is None:
+        return video_clip
+    return video_clip.fl(lambda gf, t: blend_patch(gf(t), wm), keep_duration=True)
+
+# ============================================================
+# 🔤 Fonts
+# ============================================================
+
+FONTS_DIR = os.path.join(ASSETS_DIR, "fonts")
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+FALLBACK_FONT_FILE = "BoldGothic"
+
+# assets/fonts に何もない場合に使うシステムフォント (先に見つかったもの)
+SYSTEM_FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansJP-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "C:/Windows/Fonts/meiryo.ttc",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W6.ttc",
+    DEFAULT_FONT,
+]
+
+# グリフ有無の判定に使う文字
+COVERAGE_SAMPLES = {
+    "cjk": "あア漢",
+    "emoji": "\U0001F600",
+}
+
+# 読み込み済みフォント (パス, サイズ) -> FreeTypeFont
+_font_registry = LRUCache(max_items=256)
+
+
+def get_font(font_path, size):
+    """
+    フォントを (パス, サイズ) ごとに1回だけ読み込んで使い回す
+    """
+    key = (font_path, size)
+    font = _font_registry.get(key)
+    if font is None:
+        try:
+            font = ImageFont.truetype(font_path, size)
+        except OSError:
+            font = ImageFont.load_default()
+        _font_registry.put(key, font, nbytes=0)
+    return font
+
+
+_font_index = None
+
+
+def _font_coverage(font_path):
+    """
+    フォントが日本語・絵文字のグリフを持っているか (.notdef と同じ描画なら未収録とみなす)
+    """
+    try:
+        font = ImageFont.truetype(font_path, 32)
+    except OSError:
+        return {name: False for name in COVERAGE_SAMPLES}
+
+    def render(ch):
+        mask = font.getmask(ch)
+        return mask.size, bytes(mask)
+
+    notdef = render("\U0010FFFD")
+    return {
+        name: all(render(ch) != notdef for ch in sample)
+        for name, sample in COVERAGE_SAMPLES.items()
+    }
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def build_font_index():
+    """
+    assets/fonts を1回だけ走査し、PRESETS の font_file -> フォントパス の対応表を作る
+    """
+    from config import PRESETS
+
+    fonts = {}
+    if os.path.isdir(FONTS_DIR):
+        for name in sorted(os.listdir(FONTS_DIR)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in FONT_EXTENSIONS:
+                continue
+            # 同名なら .ttf > .otf > .ttc の順で優先
+            if stem in fonts and FONT_EXTENSIONS.index(ext.lower()) >= FONT_EXTENSIONS.index(fonts[stem]["ext"]):
+                continue
+            path = os.path.join(FONTS_DIR, name)
+            fonts[stem] = {"path": path, "ext": ext.lower(), **_font_coverage(path)}
+
+    system_font = next((p for p in SYSTEM_FONT_CANDIDATES if os.path.exists(p)), DEFAULT_FONT)
+
+    tokens = {}
+    missing = []
+    for key, preset in PRESETS.items():
+        token = preset.get("font_file", "Arial")
+        if token in fonts:
+            tokens[token] = fonts[token]["path"]
+        elif FALLBACK_FONT_FILE in fonts:
+            tokens[token] = fonts[FALLBACK_FONT_FILE]["path"]
+            missing.append(key)
+        else:
+            tokens[token] = system_font
+            missing.append(key)
+
+    index = {
+        "mtime": _dir_mtime(FONTS_DIR),
+        "fonts": fonts,
+        "tokens": tokens,
+        "system_font": system_font,
+        "missing_presets": missing,
+    }
+    if missing:
+        print(f"Font index: no font file in {FONTS_DIR} for presets {missing}")
+    return index
+
+
+def get_font_index():
+    """
+    フォント索引 (assets/fonts の mtime が変わった時だけ作り直す)
+    """
+    global _font_index
+    if _font_index is None or _font_index["mtime"] != _dir_mtime(FONTS_DIR):
+        _font_index = build_font_index()
+    return _font_index
+
+
+def resolve_font(font_file):
+    """
+    preset の font_file からフォントパスを引く
+    """
+    index = get_font_index()
+    path = index["tokens"].get(font_file)
+    if path is None:
+        # PRESETS にない名前 (上書き指定など)
+        font = index["fonts"].get(font_file) or index["fonts"].get(FALLBACK_FONT_FILE)
+        path = font["path"] if font else index["system_font"]
+        index["tokens"][font_file] = path
+    return path
+
+
+def presets_without_font():
+    """
+    専用フォントが assets/fonts に無いプリセットのキー一覧
+    """
+    return list(get_font_index()["missing_presets"])
 
 # ============================================================
 # 📝 Text Overlay (via PIL & Pilmoji)
 # ============================================================
 
+MIN_FONT_SIZE = 20  # 自動縮小の下限
+
+
+class OfflineEmojiSource(BaseSource):
+    """
+    絵文字画像を取りに行かない Source (絵文字はフォントのグリフのまま描く)
+    """
+
+    def get_emoji(self, emoji, /):
+        return None
+
+    def get_discord_emoji(self, id, /):
+        return None
+
+
+_emoji_failures = 0  # 絵文字画像を取得できなかった回数 (この間に描いたテキストはキャッシュしない)
+
+
+class FallbackTwemoji(Twemoji):
+    """
+    Twemoji を取りに行き、ネットワークエラーならフォントのグリフで描く (書き出し自体は止めない)
+    """
+
+    def get_emoji(self, emoji, /):
+        global _emoji_failures
+        try:
+            return super().get_emoji(emoji)
+        except Exception as e:
+            _emoji_failures += 1
+            print(f"Emoji fetch failed ({emoji}): {e.__class__.__name__}")
+            return None
+
+
+# 絵文字画像の取得元 (pilmoji の Source クラス)。ネットワークがない環境では OfflineEmojiSource にする
+EMOJI_SOURCE = OfflineEmojiSource if os.environ.get("REEL_OFFLINE") else FallbackTwemoji
+
+# 折り返しの単位: 欧文の単語 (後ろの空白込み) / 空白 / それ以外は1文字 (日本語・絵文字)
+_WRAP_TOKEN = re.compile(r"[\u0021-\u007e\u00a0-\u024f]+ *|\s|.")
+
+
+def _split_long_token(token, font, max_width, measure):
+    """
+    1行に収まらない長い単語を文字単位で分割する
+    """
+    parts, current = [], ""
+    for ch in token:
+        if current and measure(current + ch) > max_width:
+            parts.append(current)
+            current = ch
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
 def wrap_text(text, font, max_width):
     """
     指定された幅に収まるようにテキストを改行する
+    欧文は単語単位、日本語は文字単位。各トークンの幅 (getlength) を1回ずつ測って足し込むだけ
     """
+    widths = {}
+
+    def measure(token):
+        w = widths.get(token)
+        if w is None:
+            w = widths[token] = font.getlength(token)
+        return w
+
     lines = []
     # ユーザーが入力した改行を尊重
     for paragraph in text.split('\n'):
-        words = list(paragraph) # 日本語の場合は文字単位で分割
-        if not words:
+        if not paragraph:
             lines.append("")
             continue
-            
-        current_line = ""
-        for word in words:
-            test_line = current_line + word
-            # textbboxで幅を確認
-            bbox = font.getbbox(test_line)
-            if bbox[2] - bbox[0] <= max_width:
-                current_line = test_line
+
+        tokens = []
+        for token in _WRAP_TOKEN.findall(paragraph):
+            if len(token) > 1 and measure(token.rstrip()) > max_width:
+                tokens.extend(_split_long_token(token, font, max_width, measure))
             else:
-                lines.append(current_line)
-                current_line = word
-        lines.append(current_line)
+                tokens.append(token)
+
+        current_line = ""
+        current_w = 0.0
+        for token in tokens:
+            # 行末の空白は幅に含めない
+            if current_line and current_w + measure(token.rstrip()) > max_width:
+                lines.append(current_line.rstrip())
+                current_line, current_w = "", 0.0
+                if token.isspace():
+                    continue  # 行頭の空白は捨てる
+            current_line += token
+            current_w += measure(token)
+        lines.append(current_line.rstrip() if current_line.strip() else current_line)
     return lines
 
 def create_text_image(text, font_path, fontsize=60, color='white', bg_color=None, size=(1080, 400)):
@@ -158,28 +776,28 @@ def create_text_image(text, font_path, fontsize=60, color='white', bg_color=None
     area_w, area_h = size
     max_text_w = area_w * 0.9 # 左右に5%ずつのマージン
     
-    # 1. 最適なフォントサイズを決定 (領域に収まるまで小さくする)
-    current_fontsize = fontsize
-    while current_fontsize > 20:
-        try:
-            font = ImageFont.truetype(font_path, current_fontsize)
-        except OSError:
-            font = ImageFont.load_default()
-        
-        # テキストをラッピング
+    # 1. 最適なフォントサイズを決定 (領域に収まる最大サイズを二分探索)
+    def layout(size):
+        font = get_font(font_path, size)
         lines = wrap_text(text, font, max_text_w)
-        
-        # 全体の高さを計算
         total_h = 0
-        max_measured_w = 0
         for line in lines:
             bbox = font.getbbox(line or " ")
             total_h += (bbox[3] - bbox[1]) + line_spacing
-            max_measured_w = max(max_measured_w, bbox[2] - bbox[0])
-            
-        if total_h <= area_h:
-            break
-        current_fontsize -= 5 # 収まらなければサイズを下げる
+        return font, lines, total_h
+
+    lo, hi = min(MIN_FONT_SIZE, fontsize), fontsize
+    current_fontsize = lo
+    font, lines, total_h = layout(lo)
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = layout(mid)
+        if candidate[2] <= area_h:
+            current_fontsize = mid
+            font, lines, total_h = candidate
+            lo = mid + 1
+        else:
+            hi = mid - 1
 
     # 2. 描画
     img = Image.new('RGBA', size, (0, 0, 0, 0))
@@ -191,7 +809,7 @@ def create_text_image(text, font_path, fontsize=60, color='white', bg_color=None
     if color.lower() in ['black', '#000000', '#000'] or (color.startswith('#') and color.lower() < '#444'):
         stroke_color = 'white'
 
-    with Pilmoji(img) as pilmoji:
+    with Pilmoji(img, source=EMOJI_SOURCE) as pilmoji:
         for line in lines:
             if not line:
                 current_y += current_fontsize + line_spacing
@@ -221,9 +839,51 @@ def create_text_image(text, font_path, fontsize=60, color='white', bg_color=None
     
     return np.array(img)
 
-def create_text_clip_pil(text, font_path, fontsize=70, color='white', bg_color=None, duration=3, canvas_size=(1080, 1920)):
+# テキスト画像のキャッシュ (メモリLRU + ディスク .npy)
+TEXT_CACHE_VERSION = 1  # 描画ロジックを変えたら上げる
+_text_memory_cache = LRUCache(max_items=64, max_bytes=256 * 1024 * 1024)
+_text_disk_cache = DiskCache("text", max_bytes=512 * 1024 * 1024)
+
+
+def get_text_image(text, font_path, fontsize=60, color='white', bg_color=None, size=(1080, 400)):
     """
-    テキストクリップ生成 (解像度対応)
+    create_text_image のキャッシュ付き版
+    (テキスト, フォントファイル+mtime, サイズ, 色, 背景色, 領域) が同じなら再描画しない
+    """
+    if not text:
+        return None
+
+    key = content_hash(
+        TEXT_CACHE_VERSION, text, font_path, file_signature(font_path),
+        fontsize, color, bg_color, tuple(size), EMOJI_SOURCE.__name__,
+    )
+
+    img_array = _text_memory_cache.get(key)
+    if img_array is not None:
+        return img_array
+
+    img_array = _text_disk_cache.load_array(key)
+    if img_array is None:
+        failures = _emoji_failures
+        img_array = create_text_image(text, font_path, fontsize, color, bg_color, size=size)
+        if _emoji_failures != failures:
+            return img_array  # 絵文字が代替描画なので次回は取り直す
+        try:
+            _text_disk_cache.save_array(key, img_array)
+        except OSError as e:
+            print(f"Text cache write failed: {e}")
+
+    img_array.setflags(write=False)  # 共有するので書き換え禁止
+    _text_memory_cache.put(key, img_array)
+    return img_array
+
+
+TEXT_FONTSIZE = 70  # 1080px幅のときの基準サイズ
+
+
+def render_text_overlay(text, font_path, fontsize=TEXT_FONTSIZE, color='white', bg_color=None, canvas_size=(1080, 1920)):
+    """
+    解像度に合わせたテキスト画像 (RGBA) と、キャンバス上の配置位置 (x, y) を返す
     """
     # 解像度に合わせてフォントサイズとエリアを調整
     scale = canvas_size[0] / 1080.0
@@ -233,119 +893,776 @@ def create_text_clip_pil(text, font_path, fontsize=70, color='white', bg_color=N
     area_w = canvas_size[0]
     area_h = int(canvas_size[1] * 0.3)
     
-    img_array = create_text_image(text, font_path, scaled_fontsize, color, bg_color, size=(area_w, area_h))
+    img_array = get_text_image(text, font_path, scaled_fontsize, color, bg_color, size=(area_w, area_h))
     if img_array is None:
-        return None
-        
-    txt_clip = ImageClip(img_array).set_duration(duration)
+        return None, None
     
-    # 位置: 画面下部 (margin調整)
+    # 位置: 画面下部 (下から15%のマージン)
     bottom_margin = int(canvas_size[1] * 0.15)
-    txt_clip = txt_clip.set_position(("center", "bottom")).margin(bottom=bottom_margin, opacity=0)
-    
-    return txt_clip
+    position = ((canvas_size[0] - area_w) // 2, canvas_size[1] - area_h - bottom_margin)
+    return img_array, position
+
+
+def create_text_clip_pil(text, font_path, fontsize=TEXT_FONTSIZE, color='white', bg_color=None, duration=3, canvas_size=(1080, 1920)):
+    """
+    テキストクリップ生成 (解像度対応)
+    """
+    img_array, position = render_text_overlay(text, font_path, fontsize, color, bg_color, canvas_size)
+    if img_array is None:
+        return None
+        
+    return ImageClip(img_array).set_duration(duration).set_position(position)
+
+# ============================================================
+# 🧱 Timeline Compositor
+# ============================================================
+
+class Timeline:
+    """
+    シーン・テキスト・全体エフェクトを1枚の出力バッファへ直接合成するフラットなコンポジタ
+    (CompositeVideoClip を入れ子にしない)
+
+    - scene:   make_frame(ローカル時刻) が返すフレームをそのまま下地にする
+    - overlay: 乗算済みアルファのパッチを矩形の範囲だけ合成する
+    - effect:  fn(buf, t) で出力バッファを直接書き換える (フェード・透かしなど)
+
+    どのレイヤーが有効かは区間の索引を事前に作り、フレーム番号から O(1) で引く
+    render() は同じバッファを毎回返すので、次の render() までに使い切ること
+    stats (RenderStats) を渡すとレイヤー種別・エフェクトごとの時間を記録する
+    """
+
+    def __init__(self, size, duration, fps=FPS, stats=None):
+        self.size = tuple(size)
+        self.duration = duration
+        self.fps = fps
+        self.stats = stats
+        self.layers = []   # (start, end, kind, payload) 追加順 = 重ね順
+        self.effects = []  # (name, fn)
+        self._buffer = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._index = None
+
+    def add_scene(self, start, duration, make_frame):
+        self.layers.append((start, start + duration, "scene", make_frame))
+        self._index = None
+
+    def add_overlay(self, start, duration, rgba, position=(0, 0), opacity=1.0):
+        patch = premultiply_patch(rgba, position, self.size, opacity)
+        if patch is not None:
+            self.layers.append((start, start + duration, "overlay", patch))
+            self._index = None
+
+    def add_effect(self, fn, name="effect"):
+        self.effects.append((name, fn))
+
+    def _build_index(self):
+        bounds = sorted({0.0, self.duration} | {l[0] for l in self.layers} | {l[1] for l in self.layers})
+        active = [[l for l in self.layers if l[0] <= b < l[1]] for b in bounds]
+        frame_times = np.arange(frame_count(self.duration, self.fps)) / self.fps
+        frame_slots = np.searchsorted(bounds, frame_times, side="right") - 1
+        # フレーム番号 -> 有効レイヤー (同じ区間のフレームは同じリストを共有)
+        self._index = (bounds, active, [active[i] for i in frame_slots])
+
+    def active_layers(self, t):
+        if self._index is None:
+            self._build_index()
+        bounds, active, by_frame = self._index
+        i = int(round(t * self.fps))
+        if 0 <= i < len(by_frame) and abs(i - t * self.fps) < 1e-6:
+            return by_frame[i]
+        # フレーム境界以外の時刻 (サムネイルなど)
+        slot = max(0, bisect.bisect_right(bounds, t) - 1)
+        return active[min(slot, len(active) - 1)]
+
+    def render(self, t):
+        if self.stats is not None:
+            return self._render_timed(t)
+        buf = self._buffer
+        layers = self.active_layers(t)
+        if not layers or layers[0][2] != "scene":
+            buf.fill(0)
+        for start, _, kind, payload in layers:
+            if kind == "scene":
+                buf[...] = payload(t - start)
+            else:
+                blend_patch(buf, payload, inplace=True)
+        for _, fx in self.effects:
+            fx(buf, t)
+        return buf
+
+    def _render_timed(self, t):
+        """
+        render() と同じ処理を工程ごとに計測しながら行う
+        """
+        buf, stats, clock = self._buffer, self.stats, time.perf_counter
+        layers = self.active_layers(t)
+        if not layers or layers[0][2] != "scene":
+            buf.fill(0)
+        for start, _, kind, payload in layers:
+            t0 = clock()
+            if kind == "scene":
+                buf[...] = payload(t - start)
+                stats.add("frame.animation", clock() - t0)
+            else:
+                blend_patch(buf, payload, inplace=True)
+                stats.add("frame.text_overlay", clock() - t0)
+        for name, fx in self.effects:
+            t0 = clock()
+            fx(buf, t)
+            stats.add(f"frame.{name}", clock() - t0)
+        return buf
+
+    def to_clip(self):
+        return VideoClip(self.render, duration=self.duration)
+
+
+def fadeout_effect(start, total_duration, fade_duration=FADEOUT_DURATION):
+    """
+    動画全体の最後 fade_duration 秒を黒へフェードするエフェクト
+    (start はこのタイムラインが動画全体の何秒目から始まるか)
+    """
+    def fx(buf, t):
+        gain = (total_duration - (start + t)) / fade_duration if fade_duration > 0 else 1.0
+        if gain < 1.0:
+            np.multiply(buf, max(gain, 0.0), out=buf, casting="unsafe")
+    return fx
+
+
+def watermark_effect(logo_path, size, opacity=0.3):
+    """
+    透かしロゴのエフェクト (ロゴがなければ None)
+    """
+    if not os.path.exists(logo_path) or opacity <= 0:
+        return None
+    wm = prepare_watermark(logo_path, size, opacity)
+    if wm is None:
+        return None
+    return lambda buf, t: blend_patch(buf, wm, inplace=True)
+
+# ============================================================
+# 🎞️ Encoder
+# ============================================================
+
+# 書き出し設定 (generate_reel の encoder= やサイドバーから選ぶ)
+ENCODER_PROFILES = {
+    "draft": {
+        "display_name": "ドラフト (高速)",
+        "codec": "libx264", "preset": "veryfast", "crf": 28, "threads": 0,
+        "pix_fmt": "yuv420p", "fps": 30, "audio_codec": "aac", "audio_bitrate": "96k",
+    },
+    "standard": {
+        "display_name": "標準",
+        "codec": "libx264", "preset": "medium", "crf": 23, "threads": 0,
+        "pix_fmt": "yuv420p", "fps": 30, "audio_codec": "aac", "audio_bitrate": "128k",
+    },
+    "archive": {
+        "display_name": "高画質 (保存用)",
+        "codec": "libx264", "preset": "slow", "crf": 18, "threads": 0,
+        "pix_fmt": "yuv420p", "fps": 30, "audio_codec": "aac", "audio_bitrate": "192k",
+    },
+}
+DEFAULT_ENCODER = "standard"
+
+
+def get_encoder_profile(encoder=None):
+    """
+    プロファイル名 or dict (名前 + 上書き項目 {"base": "draft", "fps": 15} など) から設定を作る
+    """
+    if encoder is None:
+        encoder = DEFAULT_ENCODER
+    if isinstance(encoder, str):
+        if encoder not in ENCODER_PROFILES:
+            raise ValueError(f"Unknown encoder profile: {encoder} (choose from {list(ENCODER_PROFILES)})")
+        return dict(ENCODER_PROFILES[encoder])
+    overrides = dict(encoder)
+    profile = get_encoder_profile(overrides.pop("base", DEFAULT_ENCODER))
+    profile.update(overrides)
+    return profile
+
+
+class FFmpegWriter:
+    """
+    RGB24 の生フレームを ffmpeg の stdin に直接流し込むライター
+    (連続した uint8 配列はコピーせずに memoryview のまま書く)
+    """
+
+    def __init__(self, output_path, size, profile, audio_path=None):
+        self.output_path = output_path
+        self.size = tuple(size)
+        self.profile = profile
+        w, h = self.size
+
+        cmd = [
+            get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(profile["fps"]), "-i", "-",
+        ]
+        if audio_path:
+            cmd += ["-i", audio_path]
+        cmd += [
+            "-map", "0:v",
+            "-c:v", profile["codec"], "-preset", profile["preset"], "-crf", str(profile["crf"]),
+            "-pix_fmt", profile["pix_fmt"], "-threads", str(profile["threads"]),
+        ]
+        if audio_path:
+            cmd += ["-map", "1:a", "-c:a", profile["audio_codec"], "-b:a", profile["audio_bitrate"]]
+        cmd += ["-movflags", "+faststart", output_path]
+
+        # stderr はパイプ詰まりを避けるため一時ファイルへ
+        self._log = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+
+    def write_frame(self, frame):
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = frame[..., :3]
+        if frame.dtype != np.uint8 or not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape[:2] != (self.size[1], self.size[0]):
+            raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match writer size {self.size[0]}x{self.size[1]}")
+        try:
+            self.proc.stdin.write(memoryview(frame))
+        except BrokenPipeError:
+            self.close()  # ffmpeg 側のエラーメッセージ付きで RuntimeError になる
+            raise
+
+    def close(self):
+        if self._log.closed:
+            return  # close 済み
+        if self.proc.stdin and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        returncode = self.proc.wait()
+        self._log.seek(0)
+        log = self._log.read().decode(errors="replace")
+        self._log.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({returncode}): {log}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 途中で失敗したら ffmpeg を止めて元の例外を優先
+            self.proc.kill()
+            self.proc.wait()
+            self._log.close()
+
+
+def frame_count(duration, fps):
+    return int(round(duration * fps))
+
+
+def write_clip(clip, output_path, profile, audio=None, progress=None, stats=None, budget=None):
+    """
+    クリップを FFmpegWriter で書き出す
+    audio は build_bgm_track の float32 配列 (一時WAVに1回で書いてから多重化)
+    progress(書き出したフレーム数, 全フレーム数) を毎フレーム呼ぶ (例外を投げれば中断)
+    stats (RenderStats) を渡すとフレームごとの get_frame / 書き込み時間を記録する
+    budget (MemoryBudget) を渡すと数フレームごとに自分 + ffmpeg のメモリを確認する
+    """
+    audio_path = None
+    if audio is not None:
+        fd, audio_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        with stage(stats, "audio_wav"):
+            audio_utils.write_wav(audio_path, audio)
+    try:
+        fps = profile["fps"]
+        total = frame_count(clip.duration, fps)
+        clock = time.perf_counter
+        with FFmpegWriter(output_path, clip.size, profile, audio_path=audio_path) as writer:
+            for i in range(total):
+                t0 = clock()
+                frame = clip.get_frame(i / fps)
+                t1 = clock()
+                writer.write_frame(frame)
+                if stats is not None:
+                    stats.record_frame(t1 - t0, clock() - t1)
+                if budget is not None and i % budget.check_every == 0:
+                    budget.check(f"{os.path.basename(output_path)} {i + 1}/{total} フレーム", pids=[writer.proc.pid])
+                if progress is not None:
+                    progress(i + 1, total)
+            if stats is not None:
+                # ffmpeg が残りをエンコードして閉じるまで
+                with stats.stage("encode_flush"):
+                    writer.close()
+    except BaseException:
+        # 中断・失敗した書きかけのファイルは残さない
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        if audio_path:
+            os.remove(audio_path)
+    return output_path
+
+# ============================================================
+# 📦 Render Cache
+# ============================================================
+
+RENDER_CACHE_VERSION = 1  # 出力が変わる修正をしたら上げる
+_render_cache = DiskCache("renders", max_bytes=int(os.environ.get("REEL_RENDER_CACHE_MB", 4096)) * 1024 * 1024)
+
+
+def render_cache_key(images, texts, preset, logo_path, target_resolution, encoder=None, draft=False, watermark_opacity=WATERMARK_OPACITY):
+    """
+    出力を決める入力すべての正規化ハッシュ
+    画像・BGM・ロゴ・フォントはパスではなく中身のハッシュで比べる (別の人が同じ素材で作っても一致する)
+    """
+    preset = dict(preset)
+    bgm_path = preset.pop("bgm_path", None)
+    bgm = cached_file_hash(bgm_path) if bgm_path and os.path.exists(bgm_path) else None
+    logo = cached_file_hash(logo_path) if watermark_opacity > 0 and logo_path and os.path.exists(logo_path) else None
+    font_path = resolve_font(preset.get("font_file", "Arial"))
+    font = cached_file_hash(font_path) if os.path.exists(font_path) else font_path
+    texts = [texts[i] if i < len(texts) else "" for i in range(len(images))]
+    return content_hash(
+        RENDER_CACHE_VERSION,
+        [cached_file_hash(p) for p in images], texts,
+        json.dumps(preset, sort_keys=True, ensure_ascii=False, default=str),
+        bgm, logo, watermark_opacity if logo else None, font,
+        tuple(target_resolution), json.dumps(get_encoder_profile(encoder), sort_keys=True), draft,
+        EMOJI_SOURCE.__name__,
+    )
+
+
+def _place_file(src, dst):
+    """
+    キャッシュ済みファイルを dst にコピーする
+    (ハードリンクだと ffmpeg -y が dst を上書きした時にキャッシュ側まで書き換わる)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    shutil.copyfile(src, dst)
+    return dst
+
+
+def render_cache_stats():
+    """
+    書き出しキャッシュのヒット/ミス回数と使用量
+    """
+    entries = _render_cache._entries()
+    return {
+        "hits": _render_cache.hits,
+        "misses": _render_cache.misses,
+        "entries": len(entries),
+        "bytes": sum(size for _, _, size in entries),
+        "max_bytes": _render_cache.max_bytes,
+    }
 
 # ============================================================
 # 🚀 Generator Main
 # ============================================================
 
-def generate_reel(images, texts, preset, output_path="output/reel.mp4", logo_path="assets/logo.png", target_resolution=(1080, 1920)):
+def scene_timeline(count, duration, fps=FPS):
+    """
+    各シーンの (開始秒, 長さ秒) をフレーム境界に揃えて返す
+    (セグメントを連結しても合計の長さがずれないように)
+    """
+    bounds = [round(i * duration * fps) for i in range(count + 1)]
+    return [(bounds[i] / fps, (bounds[i + 1] - bounds[i]) / fps) for i in range(count)]
+
+
+def add_scene_layers(timeline, start, duration, img_path, text, preset, font_path=None, draft=False):
+    """
+    1シーン分 (画像 + アニメーション + テキスト) をタイムラインに積む
+    draft=True ならリサンプルをすべて高速フィルタにする (プレビュー用)
+    """
+    target_resolution = timeline.size
+    stats = timeline.stats
+    max_zoom = animation_max_zoom(preset["animation"], duration)
+    if font_path is None:
+        font_path = resolve_font(preset.get("font_file", "Arial"))
+
+    # 1-2. 画像読み込み・EXIF回転・ブラー背景ごと平坦化 (同じ写真ならキャッシュから)
+    base_frame = get_scene_frame(img_path, target_resolution, max_zoom=max_zoom, stats=stats)
+
+    # 3. アニメーション
+    make_frame = make_animation(base_frame, preset["animation"], duration, out_size=target_resolution, fast_still=draft)
+    timeline.add_scene(start, duration, make_frame)
+
+    # 4. テキスト合成
+    if text:
+        with stage(stats, "text_render"):
+            text_img, position = render_text_overlay(text, font_path, color=preset["text_color"], canvas_size=target_resolution)
+            if text_img is not None:
+                timeline.add_overlay(start, duration, text_img, position)
+
+
+def add_global_effects(timeline, start, total_duration, logo_path, watermark_opacity=WATERMARK_OPACITY):
+    """
+    動画全体にかかるエフェクト (最後のフェードアウト → 透かし) を積む
+    """
+    timeline.add_effect(fadeout_effect(start, total_duration), name="fadeout")
+    with stage(timeline.stats, "watermark_prepare"):
+        wm_fx = watermark_effect(logo_path, timeline.size, watermark_opacity)
+    if wm_fx is not None:
+        timeline.add_effect(wm_fx, name="watermark")
+
+
+def build_bgm_track(preset, duration, crossfade=0.0):
+    """
+    BGMをループ/カットして duration 秒に合わせ、最後をフェードアウトした float32 配列 (なければ None)
+    preset に "bgm_target_dbfs" があれば、キャッシュ済みの音量メタデータで音量を揃える
+    """
+    if not ("bgm_path" in preset and preset["bgm_path"] and os.path.exists(preset["bgm_path"])):
+        return None
+    try:
+        pcm, meta = audio_utils.load_pcm(preset["bgm_path"])
+        gain = 1.0
+        if preset.get("bgm_target_dbfs") is not None:
+            gain = audio_utils.match_gain(meta, preset["bgm_target_dbfs"])
+        return audio_utils.assemble_bgm(pcm, duration, fade_duration=FADEOUT_DURATION, crossfade=crossfade, gain=gain)
+    except Exception as e:
+        print(f"BGM Error: {e}")
+        return None
+
+# ============================================================
+# 🧩 Parallel Segments
+# ============================================================
+
+def render_segment(segment_path, img_path, text, preset, target_resolution, start, duration, total_duration, logo_path, profile, draft=False, watermark_opacity=WATERMARK_OPACITY, instrument=False, progress=None, budget=None):
+    """
+    1シーン (+ フェードアウトの担当分 + 透かし) を音声なしの中間ファイルに書き出す
+    ProcessPoolExecutor から呼ばれるのでモジュール直下に置く
+    (パス, 計測結果 dict or None, 絵文字の取得に失敗した回数) を返す (計測結果は instrument=True の時だけ)
+    progress / budget は同じプロセスで呼ぶ時だけ使える (write_clip に渡す)
+    """
+    failures = _emoji_failures
+    stats = RenderStats(label=os.path.basename(segment_path)) if instrument else None
+    timeline = Timeline(target_resolution, duration, fps=profile["fps"], stats=stats)
+    add_scene_layers(timeline, 0, duration, img_path, text, preset, draft=draft)
+    add_global_effects(timeline, start, total_duration, logo_path, watermark_opacity)
+    write_clip(timeline.to_clip(), segment_path, profile, stats=stats, progress=progress, budget=budget)
+    report = stats.finish().to_dict(raw=True) if stats is not None else None
+    return segment_path, report, _emoji_failures - failures
+
+
+def concat_segments(segment_paths, output_path, audio_path=None, profile=None):
+    """
+    ffmpeg の concat demuxer で映像を再エンコードなしに連結し、BGMをエンコードして多重化する
+    """
+    profile = profile or get_encoder_profile()
+    list_path = os.path.join(os.path.dirname(os.path.abspath(segment_paths[0])), "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in segment_paths:
+            escaped = os.path.abspath(p).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path:
+        cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-c:a", profile["audio_codec"], "-b:a", profile["audio_bitrate"]]
+    cmd += ["-c:v", "copy", "-movflags", "+faststart", output_path]
+
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {result.stderr.decode(errors='replace')}")
+    return output_path
+
+
+SEGMENT_CACHE_VERSION = 1  # シーンの描画やセグメントの書き出し方を変えたら上げる
+_segment_cache = DiskCache("segments", max_bytes=2 * 1024 * 1024 * 1024)
+
+# BGM の設定はセグメントの映像に関係しない
+_AUDIO_PRESET_KEYS = ("bgm_path", "bgm_genre", "bgm_target_dbfs")
+
+
+def segment_cache_key(img_path, text, preset, target_resolution, start, duration, total_duration, logo_path, profile, draft=False, watermark_opacity=WATERMARK_OPACITY):
+    """
+    1シーン分のセグメントのキャッシュキー
+    フェードアウトにかからないシーンはタイムライン上の位置に依存しない (並べ替えても再利用できる)
+    """
+    scene_preset = {k: v for k, v in preset.items() if k not in _AUDIO_PRESET_KEYS}
+    font_path = resolve_font(preset.get("font_file", "Arial"))
+    in_fade = start + duration > total_duration - FADEOUT_DURATION
+    logo = cached_file_hash(logo_path) if watermark_opacity > 0 and logo_path and os.path.exists(logo_path) else None
+    return content_hash(
+        SEGMENT_CACHE_VERSION, cached_file_hash(img_path), text,
+        json.dumps(scene_preset, sort_keys=True, ensure_ascii=False, default=str),
+        cached_file_hash(font_path) if os.path.exists(font_path) else font_path,
+        tuple(target_resolution), duration,
+        round(total_duration - start, 6) if in_fade else None,  # フェードは「終わりまでの秒数」だけで決まる
+        logo, watermark_opacity if logo else None,
+        json.dumps(profile, sort_keys=True), draft, EMOJI_SOURCE.__name__,
+    )
+
+
+def _link_or_copy(src, dst):
+    """
+    読むだけの一時コピー (作業フォルダごと消すのでハードリンクで十分)
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+
+def generate_reel_segmented(images, texts, preset, output_path="output/reel.mp4", logo_path="assets/logo.png", target_resolution=(1080, 1920), workers=None, encoder=None, draft=False, watermark_opacity=WATERMARK_OPACITY, progress=None, stats=None, incremental=False, budget=None):
+    """
+    シーンごとに中間セグメントを書き出し、ストリームコピーで連結する
+    workers > 1 なら別プロセスで並列に書き出す
+    incremental=True なら入力が変わっていないシーンはキャッシュ済みセグメントを使い、変わったシーンだけ書き出す
+    (フェードアウト・透かしはセグメントに焼き込み済み、BGM は毎回全体で組み立てて連結時に多重化)
+    progress は (完了フレーム数, 全フレーム数) で呼ぶ (並列時はセグメントが揃うたび、1プロセスなら毎フレーム)
+    stats (RenderStats) には各セグメントの計測結果を合算する
+    budget (MemoryBudget) を渡すと1シーンずつ書き出し、シーンごと・数フレームごとにメモリを確認する
+    """
+    workers = workers or os.cpu_count() or 1
+    profile = get_encoder_profile(encoder)
+    timeline = scene_timeline(len(images), preset["duration"], fps=profile["fps"])
+    total_duration = sum(d for _, d in timeline)
+    frames = [frame_count(d, profile["fps"]) for _, d in timeline]
+    total_frames = sum(frames)
+
+    work_dir = tempfile.mkdtemp(prefix="reel_segments_")
+    try:
+        jobs = []
+        for i, img_path in enumerate(images):
+            start, duration = timeline[i]
+            jobs.append(dict(
+                segment_path=os.path.join(work_dir, f"segment_{i:03d}.mp4"),
+                img_path=img_path,
+                text=texts[i] if i < len(texts) else "",
+                preset=preset,
+                target_resolution=target_resolution,
+                start=start,
+                duration=duration,
+                total_duration=total_duration,
+                logo_path=logo_path,
+                profile=profile,
+                draft=draft,
+                watermark_opacity=watermark_opacity,
+            ))
+
+        # 変わっていないシーンはキャッシュから
+        keys = [None] * len(jobs)
+        dirty = list(range(len(jobs)))
+        if incremental:
+            with stage(stats, "segment_cache"):
+                dirty = []
+                for i, job in enumerate(jobs):
+                    keys[i] = segment_cache_key(**{k: v for k, v in job.items() if k != "segment_path"})
+                    cached = _segment_cache.get_path(keys[i], ".mp4")
+                    if cached is not None:
+                        _link_or_copy(cached, job["segment_path"])
+                    else:
+                        dirty.append(i)
+            if stats is not None:
+                stats.info["segments"] = {"total": len(jobs), "rendered": len(dirty)}
+
+        done_frames = sum(frames[i] for i in range(len(jobs)) if i not in dirty)
+        if progress is not None and done_frames:
+            progress(done_frames, total_frames)
+
+        def finished(i, result, remote=False):
+            global _emoji_failures
+            nonlocal done_frames
+            if stats is not None:
+                stats.merge(result[1])
+            if remote:
+                # 子プロセスの失敗回数を親に足す (generate_reel が書き出し全体をキャッシュするか決める)
+                _emoji_failures += result[2]
+            # 絵文字をグリフで代用したセグメントは保存しない (次回は取得し直す)
+            if keys[i] is not None and not result[2]:
+                try:
+                    _segment_cache.put_file(keys[i], ".mp4", jobs[i]["segment_path"])
+                except OSError as e:
+                    print(f"Segment cache write failed: {e}")
+            done_frames += frames[i]
+            if progress is not None:
+                progress(done_frames, total_frames)
+
+        audio_path = None
+        if workers > 1 and len(dirty) > 1:
+            # spawn: Streamlit などスレッドを持つ親プロセスからでも安全に起動する
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(dirty)), mp_context=ctx) as pool:
+                futures = {pool.submit(render_segment, **jobs[i], instrument=stats is not None): i for i in dirty}
+
+                # BGMは親プロセスで並行して組み立てる
+                audio_path = _write_bgm(preset, total_duration, work_dir, stats)
+
+                try:
+                    for future in as_completed(futures):
+                        finished(futures[future], future.result(), remote=True)
+                except BaseException:
+                    for f in futures:
+                        f.cancel()
+                    raise
+        else:
+            for i in dirty:
+                if budget is not None:
+                    release_memory_caches()  # 前のシーンの配列を残さない
+                    budget.check(f"シーン {i + 1} の読み込み前", extra_mb=scene_memory_estimate_mb(preset, jobs[i]["duration"], target_resolution, jobs[i]["img_path"]))
+                scene_progress = None
+                if progress is not None:
+                    scene_progress = lambda done, _total, base=done_frames: progress(base + done, total_frames)
+                finished(i, render_segment(**jobs[i], instrument=stats is not None, progress=scene_progress, budget=budget))
+            if budget is not None:
+                release_memory_caches()
+            audio_path = _write_bgm(preset, total_duration, work_dir, stats)
+            if budget is not None:
+                budget.check("BGM の組み立て後")
+
+        with stage(stats, "concat"):
+            return concat_segments([job["segment_path"] for job in jobs], output_path, audio_path=audio_path, profile=profile)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def scene_memory_estimate_mb(preset, duration, target_resolution, img_path=None):
+    """
+    1シーンの書き出しに必要なメモリの見込み (MB)
+    平坦化したフレーム (ズーム分オーバーサンプリング) + 縮小後の画像 + 静止フレーム + 出力バッファ
+    img_path を渡すと、シーンがキャッシュになければ元画像のデコード分も足す (デコード前に止められるように)
+    """
+    max_zoom = animation_max_zoom(preset["animation"], duration)
+    out_mb = target_resolution[0] * target_resolution[1] * 3 / (1024 * 1024)
+    estimate = out_mb * (2 * max_zoom * max_zoom + 2)
+    if img_path is not None and not scene_frame_cached(img_path, target_resolution, max_zoom):
+        estimate += decode_memory_estimate_mb(img_path, target_resolution, max_zoom)
+    return estimate
+
+
+def release_memory_caches():
+    """
+    メモリ上のシーン・テキストキャッシュを空にする (ディスク側は残るので再利用はできる)
+    """
+    _scene_memory_cache.clear()
+    _text_memory_cache.clear()
+    gc.collect()
+
+
+def _write_bgm(preset, total_duration, work_dir, stats=None):
+    """
+    BGM を組み立てて作業フォルダに WAV で書く (なければ None)
+    """
+    with stage(stats, "audio_assemble"):
+        audio = build_bgm_track(preset, total_duration)
+    if audio is None:
+        return None
+    with stage(stats, "audio_wav"):
+        return audio_utils.write_wav(os.path.join(work_dir, "bgm.wav"), audio)
+
+
+BUDGET_FFMPEG_THREADS = 2  # メモリ節約モードの x264 スレッド数 (スレッドごとに参照フレームを持つので増やすとメモリも増える)
+
+
+def generate_reel(images, texts, preset, output_path="output/reel.mp4", logo_path="assets/logo.png", target_resolution=(1080, 1920), workers=1, encoder=None, draft=False, watermark_opacity=WATERMARK_OPACITY, progress=None, instrument=False, stats_path=None, cache=False, incremental=False, max_rss_mb=None):
     """
     メイン生成ロジック
+    workers > 1 ならシーンごとに並列レンダリングして連結する
+    encoder は ENCODER_PROFILES のキー ("draft" / "standard" / "archive") か上書き dict
+    draft=True ならリサンプルを高速フィルタにする (プレビュー用)
+    progress(完了フレーム数, 全フレーム数) で進捗を受け取る (例外を投げれば中断)
+    instrument=True (または stats_path 指定) なら (出力パス, 計測結果 dict) を返す
+    stats_path を指定すると計測結果を JSON でも保存する
+    cache=True なら同じ入力の書き出し済み動画を再利用し、新しく書き出した動画も保存する
+    incremental=True ならシーンごとのセグメントをキャッシュし、入力が変わったシーンだけ書き直して連結する
+    max_rss_mb を指定するとメモリ節約モード: 1シーンずつ書き出してすぐ解放し、ffmpeg のスレッドも絞る
+    上限を超えそうになったら MemoryBudgetExceeded (MemoryError) で止める
     """
-    clips = []
-    
+    stats = None
+    if instrument or stats_path:
+        stats = RenderStats(label=os.path.basename(output_path))
+        stats.info.update(
+            images=len(images), resolution=list(target_resolution), workers=workers, draft=draft,
+            animation=preset.get("animation"), encoder=encoder,
+        )
+
+    budget = None
+    if max_rss_mb:
+        budget = MemoryBudget(max_rss_mb)
+        budget.check("書き出し開始時")
+        workers = 1
+        encoder = dict(get_encoder_profile(encoder), threads=BUDGET_FFMPEG_THREADS)
+
+    emoji_failures = _emoji_failures
+    cache_key = cached = None
+    if cache:
+        with stage(stats, "render_cache"):
+            cache_key = render_cache_key(images, texts, preset, logo_path, target_resolution, encoder, draft, watermark_opacity)
+            cached = _render_cache.get_path(cache_key, ".mp4")
+            if cached is not None:
+                _place_file(cached, output_path)
+        if stats is not None:
+            stats.info["render_cache"] = "hit" if cached else "miss"
+
+    if cached is not None:
+        if progress is not None:
+            progress(1, 1)
+    elif incremental or budget is not None or (workers != 1 and len(images) > 1):
+        output_path = generate_reel_segmented(images, texts, preset, output_path, logo_path, target_resolution, workers=workers, encoder=encoder, draft=draft, watermark_opacity=watermark_opacity, progress=progress, stats=stats, incremental=incremental, budget=budget)
+    else:
+        _render_single(images, texts, preset, output_path, logo_path, target_resolution, encoder, draft, watermark_opacity, progress, stats)
+
+    # 絵文字を取得できずグリフで代用した書き出しはキャッシュしない (次回は取得し直す)
+    if cache_key is not None and cached is None and _emoji_failures == emoji_failures:
+        try:
+            _render_cache.put_file(cache_key, ".mp4", output_path)
+        except OSError as e:
+            print(f"Render cache write failed: {e}")
+
+    if stats is None:
+        return output_path
+    if budget is not None:
+        stats.info["memory_budget"] = budget.to_dict()
+    report = stats.finish().to_dict()
+    if stats_path:
+        stats.dump(stats_path)
+    return output_path, report
+
+
+def _render_single(images, texts, preset, output_path, logo_path, target_resolution, encoder, draft, watermark_opacity, progress, stats):
+    """
+    1プロセスで全シーンを1つのタイムラインに合成して書き出す
+    """
+    profile = get_encoder_profile(encoder)
+    schedule = scene_timeline(len(images), preset["duration"], fps=profile["fps"])
+    total_duration = sum(d for _, d in schedule)
+    font_path = resolve_font(preset.get("font_file", "Arial"))
+
+    # 全シーン・テキスト・フェード・透かしを1つのタイムラインで合成
+    timeline = Timeline(target_resolution, total_duration, fps=profile["fps"], stats=stats)
     for i, img_path in enumerate(images):
         txt = texts[i] if i < len(texts) else ""
-        
-        # 1. 画像読み込み & EXIF回転
-        pil_img = Image.open(img_path)
-        pil_img = ImageOps.exif_transpose(pil_img)
-        img_clip = ImageClip(np.array(pil_img))
-        
-        # 2. アスペクト比調整
-        base_clip = resize_with_blur(img_clip, target_size=target_resolution)
-        
-        # 3. アニメーション
-        anim_clip = apply_animation(base_clip, preset["animation"], preset["duration"])
-        
-        # 4. テキスト合成
-        font_file = preset.get("font_file", "Arial")
-        font_path = DEFAULT_FONT
-        
-        # Font finding logic
-        for ext in [".ttf", ".otf", ".ttc"]:
-            candidate = os.path.join(ASSETS_DIR, "fonts", f"{font_file}{ext}")
-            if os.path.exists(candidate):
-                font_path = candidate
-                break
-        
-        if font_path == DEFAULT_FONT:
-             fallback_candidate = os.path.join(ASSETS_DIR, "fonts", "BoldGothic.otf")
-             if os.path.exists(fallback_candidate):
-                 font_path = fallback_candidate
-
-        final_clip = anim_clip
-        if txt:
-             t_clip = create_text_clip_pil(txt, font_path, color=preset["text_color"], duration=preset["duration"], canvas_size=target_resolution)
-             if t_clip:
-                 final_clip = CompositeVideoClip([anim_clip, t_clip], size=target_resolution).set_duration(preset["duration"])
-        
-        clips.append(final_clip)
-        
-    # 連結
-    final_video = concatenate_videoclips(clips, method="compose")
-    
-    
-    # BGM追加
-    if "bgm_path" in preset and preset["bgm_path"] and os.path.exists(preset["bgm_path"]):
-        try:
-            audio = AudioFileClip(preset["bgm_path"])
-            # Loop check
-            if audio.duration < final_video.duration:
-                # Loop audio to match video duration
-                if audio_loop:
-                    audio = audio_loop(audio, duration=final_video.duration)
-                else:
-                    # Manual loop fallback
-                    count = int(final_video.duration / audio.duration) + 1
-                    # Note: Concatenating AudioFileClips can be tricky, so we load subclip?
-                    # Simply making a new CompositeAudioClip with loops is safer if concatenate is hard
-                    # But concatenate_audioclips exists in moviepy.editor
-                    from moviepy.editor import concatenate_audioclips
-                    audio = concatenate_audioclips([audio] * count)
-                    audio = audio.subclip(0, final_video.duration)
-            else:
-                audio = audio.subclip(0, final_video.duration)
-                
-            # Audio Fadeout (3sec)
-            # Try to use audio_fadeout from moviepy.audio.fx.all
-            try:
-                from moviepy.audio.fx.all import audio_fadeout
-                audio = audio.fx(audio_fadeout, 3)
-            except ImportError:
-                 # Fallback: manually fadeout if possible, or skip
-                 # audio.audio_fadeout exists in some versions?
-                 if hasattr(audio, 'audio_fadeout'):
-                     audio = audio.audio_fadeout(3)
-            except Exception as e:
-                print(f"Audio Fadeout failed: {e}")
-                pass
-
-            final_video = final_video.set_audio(audio)
-        except Exception as e:
-            print(f"BGM Error: {e}")
-            pass
-            
-    # Video Fadeout (End 3 sec)
-    try:
-        final_video = final_video.fx(vfx.fadeout, 3)
-    except:
-        pass # vfx.fadeout might need color argument? vfx.fadeout(clip, duration)
-    
-    # 5. 透かし
-    final_video = add_watermark(final_video, logo_path=logo_path, opacity=0.3)
+        start, duration = schedule[i]
+        add_scene_layers(timeline, start, duration, img_path, txt, preset, font_path=font_path, draft=draft)
+    add_global_effects(timeline, 0, total_duration, logo_path, watermark_opacity)
+
+    # BGM (書き出し時に多重化)
+    with stage(stats, "audio_assemble"):
+        audio = build_bgm_track(preset, total_duration)
     
     # 書き出し
-    final_video.write_videofile(output_path, fps=30, codec="libx264", audio_codec="aac")
+    final_video = timeline.to_clip()
+    write_clip(final_video, output_path, profile, audio=audio, progress=progress, stats=stats)
     return output_path
+
+
+# ============================================================
+# ⚡ Quick Preview
+# ============================================================
+
+PREVIEW_SCALE = 1 / 3
+PREVIEW_FPS = 12
+PREVIEW_ENCODER = {"base": "draft", "preset": "ultrafast", "crf": 30, "fps": PREVIEW_FPS, "audio_bitrate": "64k"}
+
+
+def preview_resolution(target_resolution, scale=PREVIEW_SCALE):
+    """
+    プレビュー用の縮小解像度 (yuv420p のため偶数に揃える)
+    """
+    return tuple(max(2, int(round(v * scale / 2)) * 2) for v in target_resolution)
+
+
+def generate_preview(images, texts, preset, output_path="output/preview.mp4", logo_path="assets/logo.png", target_resolution=(1080, 1920), scale=PREVIEW_SCALE, fps=PREVIEW_FPS, watermark_opacity=WATERMARK_OPACITY):
+    """
+    低解像度・低fps・高速設定で数秒で確認できるプレビューを書き出す
+    """
+    encoder = dict(PREVIEW_ENCODER, fps=fps)
+    return generate_reel(
+        images, texts, preset, output_path=output_path, logo_path=logo_path,
+        target_resolution=preview_resolution(target_resolution, scale), encoder=encoder, draft=True,
+        watermark_opacity=watermark_opacity,
+    )